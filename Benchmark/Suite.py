@@ -0,0 +1,198 @@
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from Devices.Camera import Camera
+from Devices.Microphone import Microphone
+from Devices.Sources import SyntheticVideo, SyntheticAudio, FileVideo, FileAudio
+from Recorder.EncoderPool import EncoderPool
+from Recorder.Events import EventRecorder
+from Recorder.Trigger import TriggerEngine
+import Config.Settings as Settings
+
+# Metrics compared against a baseline, and whether a higher value is better
+METRICS = {
+    'capture_fps': True,
+    'latency_ms': False,
+    'video_queue_depth': False,
+    'audio_queue_depth': False,
+    'dropped_frames': False,
+    'dropped_blocks': False,
+    'cpu_percent': False,
+    'peak_rss_mb': False,
+}
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process and its finished children in MB, None where unsupported
+    """
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 ** 2 if os.uname().sysname == 'Darwin' else 1024), 1)
+
+
+class Benchmark:
+    """
+    Runs cameras and microphone on synthetic or file sources through trigger, writers and encoders.
+    Audio bursts trigger events, so the whole recording path is exercised without any device
+    """
+
+    def set_rec_status(self, rec_status):
+        # Same states the recorder apps set, overlay and frame decoding depend on them
+        for cam in self.cams:
+            cam.rec_status = rec_status
+
+    def on_start(self, trigger_time):
+        self.trigger_times.append(trigger_time)
+        self.set_rec_status(2)
+        self.events.start(self.cams, self.mic, self.output, trigger_time, self.trigger.start_source)
+
+    def on_stop(self, stop_time):
+        self.collect_latency()
+        self.events.stop(stop_time)
+        self.set_rec_status(1)
+
+    def collect_latency(self):
+        # Trigger to first write of the slowest writer in current event.
+        # Audio clock runs ahead of wall time when sources aren't paced, latency is meaningless then
+        if self.options.fast:
+            return
+        recorders = [cam.recorder for cam in self.cams] + [self.mic.recorder]
+        first_writes = [recorder.first_write for recorder in recorders]
+        if self.trigger_times and None not in first_writes:
+            self.latencies.append(max(first_writes) - self.trigger_times[-1])
+
+    def video_source(self, resolution):
+        if self.options.video:
+            return FileVideo(self.options.video, resolution, self.options.fps, not self.options.fast)
+        return SyntheticVideo(resolution, self.options.fps, not self.options.fast)
+
+    def audio_source(self):
+        if self.options.audio:
+            return FileAudio(self.options.audio, Settings.AUDIO_BLOCKSIZE, not self.options.fast)
+        return SyntheticAudio(blocksize=Settings.AUDIO_BLOCKSIZE, realtime=not self.options.fast)
+
+    def run(self, resolution):
+        """
+        Record for benchmark duration at given resolution and return metrics
+        """
+        width, height = (int(value) for value in resolution.split('x'))
+        encoder = EncoderPool(self.options.encoders) if self.options.encoders else None
+        self.trigger = TriggerEngine(self.options.threshold, self.on_start, self.on_stop)
+        self.mic = Microphone(None, self.trigger, self.audio_source())
+        self.cams = [Camera(index, resolution, True, self.options.fps, encoder=encoder, trigger=self.trigger,
+                            source=self.video_source((width, height)), preset=self.options.preset,
+                            proxy=self.options.proxy)
+                     for index in range(self.options.cameras)]
+
+        with TemporaryDirectory() as self.output:
+            # Frames are only decoded for armed cameras, pre-roll stays empty otherwise
+            self.set_rec_status(1)
+            # Grabbed frames count what cameras deliver, decoded ones depend on who needs them
+            start_grabbed = [cam.grabbed_frames for cam in self.cams]
+            start_times = os.times()
+            start = monotonic()
+            self.trigger.arm()
+            sleep(self.options.duration)
+            self.trigger.disarm()
+            elapsed = monotonic() - start
+            end_grabbed = [cam.grabbed_frames for cam in self.cams]
+            if self.trigger.active:
+                self.collect_latency()
+            # Wait for writers before closing devices
+            self.trigger.close()
+            self.events.close()
+            for cam in self.cams:
+                cam.close()
+            self.mic.close()
+            if encoder:
+                encoder.shutdown()
+            end_times = os.times()
+
+        cpu_time = sum(end_times[:4]) - sum(start_times[:4])
+        fps = [(end - begin) / elapsed for begin, end in zip(start_grabbed, end_grabbed)]
+        return {
+            'resolution': resolution,
+            'events': len(self.trigger_times),
+            'capture_fps': round(sum(fps) / len(fps), 1),
+            'latency_ms': round(max(self.latencies) * 1000, 1) if self.latencies else None,
+            'video_queue_depth': max(cam.recorder.frame_queue.max_depth for cam in self.cams),
+            'audio_queue_depth': self.mic.recorder.audio_queue.max_depth,
+            'dropped_frames': sum(cam.recorder.dropped_frames for cam in self.cams),
+            'dropped_blocks': self.mic.recorder.dropped_chunks,
+            'cpu_percent': round(cpu_time / elapsed * 100, 1),
+            'peak_rss_mb': peak_rss(),
+        }
+
+    def __init__(self, options):
+        self.options = options
+        self.cams = []
+        self.mic = None
+        self.trigger = None
+        self.output = None
+        # Single segment per event, first write of every writer then belongs to the trigger
+        self.events = EventRecorder(segment_duration=0)
+        self.trigger_times = []
+        self.latencies = []
+
+
+def measure(options, resolution, results):
+    # Runs in its own process, so peak memory and CPU time belong to this resolution only
+    results.put(Benchmark(options).run(resolution))
+
+
+def run_suite(options):
+    """
+    Benchmark every requested resolution in a fresh process, return list of metrics
+    """
+    context = get_context('spawn')
+    results = context.Queue()
+    suite = []
+    for resolution in options.resolution:
+        process = context.Process(target=measure, args=(options, resolution, results))
+        process.start()
+        suite.append(results.get())
+        process.join()
+    return suite
+
+
+def compare(suite, baseline, tolerance):
+    """
+    Return descriptions of metrics that got worse than baseline by more than tolerance
+    """
+    previous = {result['resolution']: result for result in baseline}
+    regressions = []
+    for result in suite:
+        reference = previous.get(result['resolution'])
+        if not reference:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            value, expected = result.get(metric), reference.get(metric)
+            if value is None or expected is None:
+                continue
+            if higher_is_better:
+                worse = value < expected * (1 - tolerance)
+            else:
+                # Small absolute values like a single dropped frame are not worth failing over
+                worse = value > max(expected * (1 + tolerance), expected + 1)
+            if worse:
+                regressions.append('%s %s: %s, baseline %s' % (result['resolution'], metric, value, expected))
+    return regressions
+
+
+def format_table(suite):
+    columns = ['resolution', 'events'] + list(METRICS)
+    rows = [columns] + [['-' if result[column] is None else str(result[column]) for column in columns]
+                        for result in suite]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join('  '.join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
@@ -35,9 +35,40 @@ class ConfigHandler:
         with open(self.config_file, 'w') as file:
             self.config.write(file)
 
+    def camera_index(self, available_cameras):
+        """
+        Return last used camera menu entry if it's still available, else the first camera.
+        Only reads loaded config, so devices can be opened before the menu exists
+        """
+        if not available_cameras:
+            return '-'
+        cam_index = self.config.get('Cam', 'index', fallback='')
+        try:
+            if cam_index == Settings.ALL_CAMERAS and len(available_cameras) > 1:
+                return cam_index
+            elif int(cam_index) in available_cameras:
+                # Set to last used cam index
+                return cam_index
+        except ValueError:
+            pass
+        return str(available_cameras[0])
+
+    def input_device(self, input_devices):
+        """
+        Return name of last used input device if name and index still match up, else the first device, None without any
+        """
+        input_device_name = self.config.get('Mic', 'name', fallback='')
+        try:
+            input_device_index = int(self.config.get('Mic', 'index', fallback=''))
+            if input_devices[input_device_name] == input_device_index:
+                return input_device_name
+        except (ValueError, KeyError):
+            pass
+        return next(iter(input_devices), None)
+
     def load_config(self):
         """
-        Load and verify settings from config file
+        Load and verify settings from config file, device settings are applied once devices are known
         """
 
         if not os.path.isfile(self.config_file):
@@ -45,16 +76,6 @@ class ConfigHandler:
 
         self.config.read(self.config_file)
 
-        # Camera settings
-        cam_index = self.config['Cam']['index']
-        try:
-            if self.main.available_cameras:
-                if int(cam_index) in self.main.available_cameras:
-                    # Set to last used cam index
-                    self.main.cam_index.set(cam_index)
-        except ValueError:
-            pass
-
         # Resolution settings
         resolution = self.config['Cam']['resolution']
         if resolution in Settings.RESOLUTIONS:
@@ -65,17 +86,6 @@ class ConfigHandler:
         if hud_enabled in ('True', 'False'):
             self.main.overlay_enabled.set(hud_enabled)
 
-        # Input device settings
-        input_device_name = self.config['Mic']['name']
-        try:
-            input_device_index = int(self.config['Mic']['index'])
-            if self.main.input_devices[input_device_name] == input_device_index:
-                # Set index and name to last used input device if name and index match up
-                self.main.device_index = input_device_index
-                self.main.input_device_name.set(input_device_name)
-        except (ValueError, KeyError):
-            pass
-
         # Threshold settings
         audio_clamp = Settings.AUDIO_CLAMP
         threshold = self.config['Mic']['threshold']
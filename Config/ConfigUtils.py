@@ -15,7 +15,7 @@ def get_config_dir():
     if using_windows():
         return os.path.join(os.environ['USERPROFILE'], Settings.CONFIG_PATH)  # Windows
     else:
-        return os.path.join('~/.config', Settings.CONFIG_PATH)  # UNIX
+        return os.path.join(os.path.expanduser('~/.config'), Settings.CONFIG_PATH)  # UNIX
 
 
 def get_documents_dir():
@@ -1,5 +1,3 @@
-import cv2
-
 VERSION = '1.0'
 ICON_PATH_WIN = 'Assets/icon.ico'
 ICON_PATH_UNIX = 'Assets/icon.png'
@@ -13,9 +11,36 @@ WINDOW_REL_SIZE = 1 / 2
 AUDIO_METER_WIDTH = 30
 AUDIO_METER_COLOR = '#f0f0f0'
 AUDIO_CLAMP = -60
-CAP_BACKEND_WIN = cv2.CAP_DSHOW
-CAP_BACKEND_UNIX = cv2.CAP_V4L2
+AUDIO_BLOCKSIZE = 2048
+# Frequency bands in Hz analysed for every audio block, the trigger can key on any of them
+AUDIO_BANDS = {'low': (20, 250), 'voice': (300, 3400), 'high': (3400, 12000)}
+AUDIO_A_WEIGHTING = True
+AUDIO_RING_HEADROOM = 1  # seconds kept on top of pre-roll while it's being flushed
+AUDIO_QUEUE_DURATION = 30  # seconds of audio the writer may fall behind before blocks are dropped
+AUDIO_FORMAT = 'wav'  # 'flac' or 'opus' are opt-in, opus falls back to flac on unsupported sample rates
+AUDIO_COMPRESSION = 0.5  # 0 fastest / largest to 1 slowest / smallest
+AUDIO_WRITE_BATCH = 1  # seconds of audio collected before each file write
+TRIGGER_HOLD_TIME = 5  # seconds recording continues after level drops below release threshold
+TRIGGER_HYSTERESIS = 6  # dB between attack and release threshold
+TRIGGER_SOURCE = 'peak'  # 'peak', 'rms' or name of a band in AUDIO_BANDS
+TRIGGER_MODE = 'audio'  # 'audio', 'motion', 'or' / 'and' to combine both
+MOTION_SIZE = (160, 90)  # frames are downscaled to this size for motion detection
+MOTION_SENSITIVITY = 25  # gray level difference counting as change
+MOTION_MIN_AREA = 0.005  # smallest moving blob as fraction of the frame
+MOTION_MASK = []  # ignored regions as (x, y, width, height) fractions of the frame
+MOTION_ADAPTION = 0.05  # how quickly background follows the scene
+MOTION_WINDOW = 1  # seconds motion counts as present when combining with 'and'
+# OpenCV capture backends, cv2.CAP_DSHOW and cv2.CAP_V4L2, numeric so settings don't import OpenCV
+CAP_BACKEND_WIN = 700
+CAP_BACKEND_UNIX = 200
+CAPTURE_FORMATS = ('MJPG', 'YUYV')  # tried in order, MJPG allows full frame rate at 1080p over USB 2
 PREVIEW_ASPECT_RATIO = 16 / 9
+PREVIEW_POLL_INTERVAL = 10  # ms before live view checks again for a new frame
+PREVIEW_FPS = 30  # preview and meter refresh rate without cameras, otherwise they follow the fastest camera
+WORKER_POLL_INTERVAL = 20  # ms between checks for results of background workers
+# Imported by a background worker after the window is shown, in this order
+STARTUP_IMPORTS = ('numpy', 'cv2', 'PIL.ImageTk', 'sounddevice', 'soundfile', 'av')
+ALL_CAMERAS = 'All'  # camera menu entry recording from every camera
 RESOLUTIONS = ['1920x1080', '1280x720', '1024x576', '640x360']
 METER_THRESHOLD_ORANGE = -20
 METER_THRESHOLD_RED = -10
@@ -24,3 +49,65 @@ METER_COLOR_ORANGE = '#cf7215'
 METER_COLOR_RED = '#ff0000'
 REC_COLOR_GREEN = (21, 207, 49)
 REC_COLOR_RED = (255, 0, 0)
+OVERLAY_FIELDS = ('time',)  # any of 'time', 'camera', 'volume', 'rec'
+OVERLAY_REFRESH = 1  # seconds between HUD redraws
+PREROLL_DURATION = 5
+PREROLL_COMPRESSED = True
+PREROLL_JPEG_QUALITY = 90
+PREROLL_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes per camera
+FRAME_POOL_HEADROOM = 60  # frame slots for preview and writers
+ENCODER_PROCESSES = 1  # 0 encodes video on a thread in the capture process
+ENCODER_CHECK_INTERVAL = 1  # seconds between checks whether an encoder process died
+ENCODER_SHUTDOWN_TIMEOUT = 10  # seconds encoder processes get to finish their files on exit
+ENCODER_QUEUE_SIZE = 120  # jobs waiting for an encoder process before writers wait for it
+WRITER_THREADS = 4  # threads writing files of all cameras and the microphone
+WRITER_BATCH = 16  # frames or audio blocks a writer thread writes before moving on to another file
+CONSTANT_FRAME_RATE = True  # duplicate or drop frames so file duration matches capture time
+VIDEO_PRESET = 'auto'  # one of ENCODER_PRESETS, 'auto' picks the best one this machine sustains
+# Presets with a fourcc are written by OpenCV, others and muxed output by PyAV using codec and options
+ENCODER_PRESETS = {
+    'mjpg': {'fourcc': 'MJPG', 'codec': 'mjpeg', 'pix_fmt': 'yuvj420p'},
+    'xvid': {'fourcc': 'XVID', 'codec': 'mpeg4'},
+    'h264': {'codec': 'libx264', 'options': {'preset': 'veryfast', 'crf': '23'}},
+    'ffv1': {'fourcc': 'FFV1', 'codec': 'ffv1'},
+}
+CALIBRATION_ORDER = ('h264', 'xvid', 'mjpg')  # most compact first, last one is used if none keeps up
+CALIBRATION_HEADROOM = 1.5  # encoder has to manage this multiple of the frame rate of all cameras
+CALIBRATION_FRAMES = 30
+ENCODER_CACHE_FILE = 'encoders.json'
+# Single audio / video container, requires PyAV. Video is then encoded on a thread per camera in the
+# capture process instead of by ENCODER_PROCESSES
+MUX_OUTPUT = False
+PROXY_ENABLED = False  # low resolution copy of every clip for browsing over the network
+PROXY_WIDTH = 320  # height follows camera aspect ratio
+PROXY_FPS = 5
+PROXY_PRESET = 'xvid'
+PROXY_SUFFIX = ' proxy'  # appended to main clip name
+THUMBNAIL_FILE = 'thumbnails.jpg'  # strip per event made from proxies, one row per camera
+THUMBNAIL_COUNT = 10
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_QUALITY = 80
+MUX_AUDIO_CODEC = 'flac'
+HEADLESS_THRESHOLD = -20  # dB, used if neither config nor command line set one
+CAMERA_CACHE_FILE = 'cameras.json'
+PROBE_TIMEOUT = 3  # seconds a camera may take to open while probing
+PROBE_FPS = 60  # requested while probing, driver answers with the closest supported rate
+SEGMENT_DURATION = 300  # seconds per file, 0 writes each event as a single segment
+SEGMENT_INDEX_FILE = 'index.json'  # lists closed segments in every event directory
+PREALLOCATE = True  # reserve disk space for segments at the size of the previous one
+RETENTION_MAX_AGE = 0  # seconds events are kept, 0 keeps them until space runs low
+RETENTION_MIN_FREE = 0  # bytes kept free on output drive by deleting oldest events, 0 never deletes for space
+RETENTION_INTERVAL = 60  # seconds between retention checks
+CATALOG_FILE = 'catalog.db'  # SQLite catalog of events in output directory
+METRICS_PORT = 9464  # Prometheus endpoint on localhost, 0 disables it
+METRICS_HOST = '127.0.0.1'
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)  # seconds
+METRICS_HUD = False  # frame rate, writer queue and drops drawn into preview
+
+# Live view
+LIVE_PORT = 0  # MJPEG live view over HTTP on localhost, 0 disables it
+LIVE_HOST = '127.0.0.1'
+LIVE_JPEG_QUALITY = 80
+LIVE_MAX_FPS = 15  # frames encoded per second and stream, shared by all its clients
+LIVE_CLIENT_TIMEOUT = 10  # seconds before a client that stopped reading is dropped
+LIVE_WIDTHS = (320, 640, 1280)  # requested widths snap to the next larger one, wider requests get full size
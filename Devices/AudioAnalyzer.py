@@ -0,0 +1,106 @@
+import numpy as np
+
+import Config.Settings as Settings
+
+# numpy >= 2.0 can write FFT results into a preallocated array
+FFT_OUT = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+
+class AudioAnalyzer:
+    """
+    Per block audio analysis: per channel RMS and peak, per sample peak and band energies.
+    All work buffers are preallocated, so analysing a block doesn't allocate full size arrays
+    """
+
+    @staticmethod
+    def a_weighting(freqs):
+        """
+        Return A-weighting power gain for frequencies (IEC 61672)
+        """
+        f2 = freqs ** 2
+        ra = (12194 ** 2 * f2 ** 2) / ((f2 + 20.6 ** 2) * np.sqrt((f2 + 107.7 ** 2) * (f2 + 737.9 ** 2))
+                                       * (f2 + 12194 ** 2))
+        # Normalized to 0 dB at 1 kHz
+        return (ra * 10 ** (2 / 20)) ** 2
+
+    @staticmethod
+    def to_db(power):
+        return 10 * np.log10(power) if power > 0 else -np.inf
+
+    def allocate(self, frames):
+        """
+        Preallocate buffers and band matrix for block size
+        """
+        self.frames = frames
+        channels = self.channels
+        self.squares = np.empty((frames, channels), dtype=np.float32)
+        self.abs = np.empty((frames, channels), dtype=np.float32)
+        self.sample_peak = np.empty(frames, dtype=np.float32)
+        self.mean_square = np.empty(channels, dtype=np.float32)
+        self.peak = np.empty(channels, dtype=np.float32)
+        self.mono = np.empty(frames, dtype=np.float32)
+        self.window = np.hanning(frames).astype(np.float32)
+        self.spectrum = np.empty(frames // 2 + 1, dtype=np.complex64)
+        self.power = np.empty(frames // 2 + 1, dtype=np.float32)
+        self.imag = np.empty(frames // 2 + 1, dtype=np.float32)
+
+        # Parseval scaling, so a band holding the whole signal matches its mean square
+        scale = 2 / (frames * np.sum(self.window ** 2))
+        freqs = np.fft.rfftfreq(frames, 1 / self.samplerate)
+        gain = self.a_weighting(freqs) if self.weighted else np.ones_like(freqs)
+        # Each row sums the weighted bins belonging to one band
+        self.band_matrix = np.zeros((len(self.band_names), len(freqs)), dtype=np.float32)
+        for row, (low, high) in enumerate(self.bands.values()):
+            in_band = (freqs >= low) & (freqs < high)
+            self.band_matrix[row, in_band] = gain[in_band] * scale
+        self.band_power = np.empty(len(self.band_names), dtype=np.float32)
+
+    def analyze(self, in_data):
+        """
+        Analyze audio block of shape (frames, channels)
+        """
+        if len(in_data) != self.frames:
+            self.allocate(len(in_data))
+
+        # Level
+        np.multiply(in_data, in_data, out=self.squares)
+        np.mean(self.squares, axis=0, out=self.mean_square)
+        np.abs(in_data, out=self.abs)
+        np.max(self.abs, axis=0, out=self.peak)
+        np.max(self.abs, axis=1, out=self.sample_peak)
+        self.volume = self.to_db(self.mean_square.mean())
+
+        # Band energies of windowed mono mix
+        if self.band_names:
+            np.mean(in_data, axis=1, out=self.mono)
+            np.multiply(self.mono, self.window, out=self.mono)
+            if FFT_OUT:
+                np.fft.rfft(self.mono, out=self.spectrum)
+            else:
+                self.spectrum[:] = np.fft.rfft(self.mono)
+            np.multiply(self.spectrum.real, self.spectrum.real, out=self.power)
+            np.multiply(self.spectrum.imag, self.spectrum.imag, out=self.imag)
+            np.add(self.power, self.imag, out=self.power)
+            np.dot(self.band_matrix, self.power, out=self.band_power)
+
+    def band_level(self, name):
+        """
+        Level of frequency band in dB
+        """
+        return self.to_db(self.band_power[self.band_names.index(name)])
+
+    @property
+    def rms(self):
+        # Per channel RMS
+        return np.sqrt(self.mean_square)
+
+    def __init__(self, samplerate, channels, bands=Settings.AUDIO_BANDS, weighted=Settings.AUDIO_A_WEIGHTING):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.bands = bands
+        self.band_names = list(bands)
+        self.weighted = weighted
+
+        self.volume = -np.inf
+        self.frames = 0
+        self.allocate(Settings.AUDIO_BLOCKSIZE)
@@ -1,18 +1,31 @@
-from PIL import Image, ImageTk
-from datetime import datetime
-from threading import Thread
+from threading import Thread, Lock
+from time import monotonic
+from math import inf
+import logging
+import numpy as np
 import cv2
 
 from Recorder.VideoRecorder import VideoRecorder
 from Config import ConfigUtils
+from Devices.CameraDiscovery import CameraDiscovery
+from Devices.FramePool import FramePool
+from Devices.Overlay import Overlay
+from Devices.MotionDetector import MotionDetector
+from Recorder.Metrics import registry
 import Config.Settings as Settings
 
+log = logging.getLogger(__name__)
+
 
 class Camera:
     """
     Resembles a Video camera
     """
 
+    # Indices of devices opened by cameras, probing them while they capture would fail
+    in_use = set()
+    discovery = None
+
     @staticmethod
     def get_backend():
         """
@@ -28,69 +41,242 @@ class Camera:
         """
         Determine all available cameras
         """
-        available_cameras = []
-        backend = Camera.get_backend()
-        for i in range(max_cameras):
-            cap = cv2.VideoCapture(i, backend)
-            if cap.isOpened():
-                available_cameras.append(i)
-            cap.release()
-        return available_cameras
+        Camera.discovery = CameraDiscovery(Camera.get_backend())
+        return sorted(Camera.discovery.discover(max_cameras))
+
+    @staticmethod
+    def revalidate_cameras(on_change):
+        """
+        Probe cameras found in cache again in background, on_change gets the available cameras if they differ.
+        Open cameras keep their cached entry
+        """
+        if Camera.discovery:
+            Camera.discovery.revalidate(lambda cameras: on_change(sorted(cameras)), lambda: set(Camera.in_use))
+
+    @staticmethod
+    def fourcc_name(fourcc):
+        return ''.join(chr((int(fourcc) >> 8 * i) & 0xFF) for i in range(4)).strip('\0 ')
+
+    def negotiate(self, cap, width, height, fps):
+        """
+        Request capture format, resolution and frame rate, trying preferred pixel formats first.
+        Return mode the driver actually granted
+        """
+        mode = None
+        for pixel_format in Settings.CAPTURE_FORMATS:
+            # Pixel format has to be set first, it limits which sizes and rates are available
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*pixel_format))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            cap.set(cv2.CAP_PROP_FPS, fps)
+            mode = {
+                'format': self.fourcc_name(cap.get(cv2.CAP_PROP_FOURCC)),
+                'resolution': '%dx%d' % (cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'fps': cap.get(cv2.CAP_PROP_FPS)
+            }
+            if mode['format'] == pixel_format:
+                break
+        log.info('Camera %d granted %s %s at %.1f fps, requested %dx%d at %d fps',
+                 self.cam_index, mode['format'], mode['resolution'], mode['fps'], width, height, fps)
+        return mode
+
+    def frame_needed(self):
+        """
+        Whether grabbed frame has to be decoded: pre-roll and writer need every frame while armed,
+        motion detection while trigger is armed, preview and live view once they took the previous frame
+        """
+        seq = self.pool.seq
+        return (self.rec_status or self.writing() or self.preview_seq == seq or self.live_seq == seq
+                or self.motion_detector is not None and self.trigger.armed)
+
+    def writing(self):
+        # Whether main or proxy writer is still busy with a clip
+        return self.recorder.is_recording or self.proxy is not None and self.proxy.is_recording
 
     def retrieve_preview(self, size):
         """
-        Retrieve camera preview for MainWindow
+        Retrieve downscaled RGB camera preview, None if there's no new frame since last call
         """
-        frame = self.current_frame
-        if frame is None:
+        index = self.current_frame
+        seq = self.pool.seq
+        if index is None or seq == self.preview_seq:
+            return
+        self.preview_seq = seq
+        slot_seq = self.pool.seqs[index]
+        width, height = size
+        if self.preview_buffer is None or self.preview_buffer.shape[:2] != (height, width):
+            # Preview size changed
+            self.preview_buffer = np.empty((height, width, 3), dtype=np.uint8)
+        # Downscale first, then only convert colors of the small frame
+        cv2.resize(self.pool.frames[index], size, dst=self.preview_buffer, interpolation=cv2.INTER_AREA)
+        if not self.pool.valid(index, slot_seq):
+            # Slot got overwritten while downscaling, capture already decodes the next frame
             return
-        resized_frame = cv2.resize(frame, size)
+        cv2.cvtColor(self.preview_buffer, cv2.COLOR_BGR2RGB, dst=self.preview_buffer)
         rec_status = self.rec_status
         if rec_status:
-            cv2.circle(resized_frame, self.circle_pos, self.circle_radius, self.rec_colors[rec_status], -1)
-        image = Image.fromarray(resized_frame)
-        imgtk = ImageTk.PhotoImage(image=image)
-        return imgtk
+            cv2.circle(self.preview_buffer, self.circle_pos, self.circle_radius, self.rec_colors[rec_status], -1)
+        if Settings.METRICS_HUD:
+            # Only drawn into preview, recordings stay clean
+            stats = '%.1f fps  queue %d  dropped %d' % (self.capture_fps, len(self.recorder.frame_queue),
+                                                        self.recorder.dropped_frames)
+            cv2.putText(self.preview_buffer, stats, (5, height - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.4,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+        return self.preview_buffer
+
+    def retrieve_live(self, seen_seq, size=None, out=None):
+        """
+        Copy latest frame for live view into out, downscaled to size if given. Return its sequence number and the copy,
+        None if there's no frame newer than seen_seq, it got overwritten while copying or camera is closed
+        """
+        with self.close_lock:
+            if not self.capture:
+                return None
+            seq = self.pool.seq
+            # Capture thread decodes next frame once it sees this one was taken
+            self.live_seq = seq
+            index = self.current_frame
+            if index is None or seq == seen_seq:
+                return None
+            slot_seq = self.pool.seqs[index]
+            if size is None:
+                frame = self.pool.copy(index, slot_seq, out)
+            else:
+                frame = cv2.resize(self.pool.frames[index], size, dst=out, interpolation=cv2.INTER_AREA)
+                if not self.pool.valid(index, slot_seq):
+                    frame = None
+        if frame is None:
+            return None
+        return seq, frame
+
+    def metrics(self):
+        labels = {'camera': self.cam_index}
+        yield 'camrec_frames_captured_total', labels, self.grabbed_frames
+        yield 'camrec_frames_decoded_total', labels, self.pool.seq
+        yield 'camrec_capture_fps', labels, self.capture_fps
+        yield 'camrec_capture_mode', dict(labels, format=self.mode['format'], resolution=self.mode['resolution']), \
+            self.mode['fps']
+        yield from self.recorder.metrics(labels)
+        if self.proxy:
+            yield from self.proxy.metrics(dict(labels, stream='proxy'))
+
+    def add_proxy_frame(self, frame, timestamp):
+        """
+        Downscale frame into proxy pool at proxy frame rate, proxy writer and pre-roll take it like the main stream
+        """
+        if timestamp < self.proxy_due:
+            return
+        interval = 1 / self.proxy.fps
+        # Next frame is due one interval later, without catching up on frames missed while capture stalled
+        self.proxy_due = max(self.proxy_due, timestamp - interval / 2) + interval
+        pool = self.proxy_pool
+        index = pool.next_slot()
+        pool.invalidate(index)
+        cv2.resize(frame, pool.resolution, dst=pool.frames[index], interpolation=cv2.INTER_AREA)
+        seq = pool.commit(index, timestamp)
+        self.proxy.buffer_frame(index, seq)
+        if self.proxy.is_recording:
+            self.proxy.add_frame(index, seq)
 
     def frame_capture(self):
+        pool = self.pool
         while self.capture:
-            ret, cap = self.cap.read()
+            # Frames are always dequeued from driver, but only decoded when somebody needs them
+            if not self.cap.grab():
+                continue
+            self.grabbed_frames += 1
+            timestamp = monotonic()
+            if timestamp - self.fps_time >= 1:
+                # Measured frame rate, updated once a second
+                self.capture_fps = (self.grabbed_frames - self.fps_count) / (timestamp - self.fps_time)
+                self.fps_time, self.fps_count = timestamp, self.grabbed_frames
+                if not self.recorder.is_recording:
+                    # Files get the rate camera really delivers, not the one requested
+                    self.recorder.fps = round(self.capture_fps, 2)
+            if not self.frame_needed():
+                continue
+            index = pool.next_slot()
+            slot = pool.frames[index]
+            pool.invalidate(index)
+            ret, frame = self.cap.retrieve(image=slot)
             if ret:
+                if frame.ctypes.data != slot.ctypes.data:
+                    # Driver delivered frame in a different size, fit it into slot
+                    cv2.resize(frame, pool.resolution, dst=slot)
+                # Detected before HUD is drawn, clock and level readout would count as motion
+                if self.motion_detector and self.motion_detector.detect(slot):
+                    self.trigger.motion(timestamp)
                 if self.overlay_enabled:
-                    date_time_str = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-                    cv2.putText(cap, date_time_str, self.text_pos, self.font,
-                                self.font_size, (255, 255, 255), self.font_thickness)
+                    self.overlay.recording = self.rec_status == 2
+                    self.overlay.apply(slot)
+                seq = pool.commit(index, timestamp)
+                # Buffered first, recorder takes frames from circular buffer while flushing pre-roll
+                self.recorder.buffer_frame(index, seq)
                 if self.recorder.is_recording:
-                    self.recorder.add_frame(cap)
-                self.recorder.buffer_frame(cap)
-                frame = cv2.cvtColor(cap, cv2.COLOR_BGR2RGB)
-                self.current_frame = frame
+                    self.recorder.add_frame(index, seq)
+                if self.proxy:
+                    self.add_proxy_frame(slot, timestamp)
+                self.current_frame = index
 
-    def record(self, out_path):
+    def record(self, out_path, start_time=None, muxer=None, stream=0):
         if self.recorder.is_recording:
             return
-        self.recorder.record = True
-        Thread(target=self.recorder.save_file, args=[out_path], daemon=True).start()
+        self.recorder.start(start_time)
+        self.recorder.save_file(out_path, muxer, stream)
+
+    def record_proxy(self, out_path, start_time=None):
+        # Proxy is always its own file, encoded alongside main stream by the writer pool
+        if self.proxy.is_recording:
+            return
+        self.proxy.start(start_time)
+        self.proxy.save_file(out_path)
 
-    def stop_recording(self):
-        self.recorder.record = False
+    def stop_recording(self, stop_time=None):
+        self.recorder.stop(stop_time)
+        if self.proxy:
+            self.proxy.stop(stop_time)
 
     def close(self):
         # Close camera
-        self.capture = False
+        registry.unregister(self)
+        # Live view may be copying a frame from another thread, pool is only closed once it's done
+        with self.close_lock:
+            self.capture = False
         self.cap_thread.join()
         self.cap.release()
+        Camera.in_use.discard(self.cam_index)
+        self.recorder.close()
+        self.pool.close()
+        if self.proxy:
+            self.proxy.close()
+            self.proxy_pool.close()
 
-    def __init__(self, cam_index, resolution, overlay_enabled=False, fps=30, buffer_duration=5):
+    def __init__(self, cam_index, resolution, overlay_enabled=False, fps=30,
+                 buffer_duration=Settings.PREROLL_DURATION, encoder=None, trigger=None, source=None,
+                 preset='xvid', proxy=Settings.PROXY_ENABLED):
         self.cam_index = cam_index
         self.resolution = resolution
         self.overlay_enabled = overlay_enabled
 
         # Frame capture
         self.capture = True
+        self.close_lock = Lock()
         self.current_frame = None
+        self.capture_fps = 0
+        self.grabbed_frames = 0
+        self.fps_time = monotonic()
+        self.fps_count = 0
+
+        # Preview
+        self.preview_buffer = None
         self.cap_thread = Thread(target=self.frame_capture, daemon=True)
 
+        # Motion detection only runs if trigger makes use of it
+        self.trigger = trigger
+        self.motion_detector = None
+        if trigger and trigger.mode != 'audio':
+            self.motion_detector = MotionDetector()
+
         # Recording settings
         self.rec_status = 0
         self.rec_colors = {
@@ -108,24 +294,53 @@ class Camera:
         width, height = resolution.split('x')
         width, height = int(width), int(height)
 
-        self.recorder = VideoRecorder((width, height), fps, buffer_duration)
+        # Raw pre-roll lives in the frame pool itself, compressed pre-roll only needs writer headroom
+        pool_size = Settings.FRAME_POOL_HEADROOM
+        if not Settings.PREROLL_COMPRESSED:
+            pool_size += int(fps * buffer_duration)
+        # Encoder processes read frames straight from shared memory
+        self.pool = FramePool(pool_size, (width, height), shared=encoder is not None)
+        # Equal to pool sequence number while preview waits for a frame
+        self.preview_seq = self.pool.seq
+        # Set by live view the same way
+        self.live_seq = None
+
+        self.recorder = VideoRecorder(self.pool, fps, buffer_duration, Settings.FRAME_POOL_HEADROOM,
+                                      encoder=encoder, preset=preset)
+
+        # Optional low resolution, low frame rate copy, downscaled once per proxy frame
+        self.proxy = None
+        self.proxy_pool = None
+        self.proxy_due = -inf
+        if proxy:
+            proxy_fps = min(Settings.PROXY_FPS, fps)
+            proxy_size = (Settings.PROXY_WIDTH, round(height * Settings.PROXY_WIDTH / width / 2) * 2)
+            # Proxy frames are small, its pre-roll stays raw
+            self.proxy_pool = FramePool(Settings.FRAME_POOL_HEADROOM + int(proxy_fps * buffer_duration), proxy_size,
+                                        shared=encoder is not None)
+            self.proxy = VideoRecorder(self.proxy_pool, proxy_fps, buffer_duration, Settings.FRAME_POOL_HEADROOM,
+                                       compress_buffer=False, encoder=encoder, preset=Settings.PROXY_PRESET)
 
         # HUD Settings
-        self.text_pos = (int(width * 0.01), int(height * 0.05))
-        self.font = cv2.FONT_HERSHEY_SIMPLEX
-        self.font_size = width / 1280
-        self.font_thickness = max(1, int(width / 480))
+        self.overlay = Overlay((width, height), 'Cam %d' % cam_index)
         self.circle_pos = (464, 11)
         self.circle_radius = 6
 
-        # Create opencv videocapture
-        backend = self.get_backend()
-        self.cap = cv2.VideoCapture(self.cam_index, backend)
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-        self.cap.set(cv2.CAP_PROP_FPS, fps)
+        # Create opencv videocapture, unless frames come from a synthetic or file source
+        if source is None:
+            backend = self.get_backend()
+            source = cv2.VideoCapture(self.cam_index, backend)
+            Camera.in_use.add(self.cam_index)
+            self.mode = self.negotiate(source, width, height, fps)
+            # Start from the rate driver granted until a measured one is available
+            if self.mode['fps'] > 0:
+                self.recorder.fps = self.mode['fps']
+        else:
+            self.mode = {'format': type(source).__name__, 'resolution': resolution, 'fps': fps}
+        self.cap = source
 
         self.cap_thread.start()
+        registry.register(self)
 
     def __enter__(self):
         return self
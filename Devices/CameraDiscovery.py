@@ -0,0 +1,157 @@
+from threading import Thread
+from time import monotonic
+from glob import glob
+import json
+import os
+import cv2
+
+from Config import ConfigUtils
+import Config.Settings as Settings
+
+SYSFS_VIDEO = '/sys/class/video4linux'
+
+
+class CameraDiscovery:
+    """
+    Finds video devices quickly: enumerates device nodes, probes them in parallel with a timeout
+    and caches their capabilities next to the config file for instant warm starts.
+    Cached devices are probed again in background once the app is up, changes are reported to it
+    """
+
+    @staticmethod
+    def read_sysfs(node, attribute):
+        try:
+            with open(os.path.join(SYSFS_VIDEO, node, attribute)) as file:
+                return file.read().strip()
+        except OSError:
+            return None
+
+    @staticmethod
+    def enumerate_devices(max_cameras):
+        """
+        Return list of (index, name) of candidate capture devices without opening them
+        """
+        if ConfigUtils.using_windows() or not os.path.isdir(SYSFS_VIDEO):
+            # No device nodes to look at, every index is a candidate
+            return [(index, '') for index in range(max_cameras)]
+        devices = []
+        for path in glob('/dev/video*'):
+            node = os.path.basename(path)
+            try:
+                index = int(node[len('video'):])
+            except ValueError:
+                continue
+            # Metadata nodes belonging to a camera have an index > 0
+            if CameraDiscovery.read_sysfs(node, 'index') not in (None, '0'):
+                continue
+            devices.append((index, CameraDiscovery.read_sysfs(node, 'name') or ''))
+        return sorted(devices)
+
+    def probe(self, index, results):
+        """
+        Open device and determine supported resolutions and frame rates
+        """
+        cap = cv2.VideoCapture(index, self.backend)
+        if not cap.isOpened():
+            cap.release()
+            return
+        modes = {}
+        # Probe with the pixel format cameras get opened with, it decides which rates are offered
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*Settings.CAPTURE_FORMATS[0]))
+        for resolution in Settings.RESOLUTIONS:
+            width, height = map(int, resolution.split('x'))
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            cap.set(cv2.CAP_PROP_FPS, Settings.PROBE_FPS)
+            # Driver falls back to a different mode if resolution isn't supported
+            if (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))) == (width, height):
+                modes[resolution] = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+        results[index] = modes
+
+    def probe_all(self, indices):
+        """
+        Probe devices in parallel, devices not responding within timeout count as unavailable
+        """
+        results = {}
+        threads = [Thread(target=self.probe, args=(index, results), daemon=True) for index in indices]
+        for thread in threads:
+            thread.start()
+        deadline = monotonic() + Settings.PROBE_TIMEOUT
+        for thread in threads:
+            thread.join(max(0, deadline - monotonic()))
+        return dict(results)
+
+    def load_cache(self):
+        try:
+            with open(self.cache_file) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save_cache(self, fingerprint, cameras):
+        cache = {
+            'fingerprint': fingerprint,
+            'cameras': {str(index): {'name': name, 'modes': cameras[index]}
+                        for index, name in fingerprint if index in cameras}
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with open(self.cache_file, 'w') as file:
+                json.dump(cache, file, indent=2)
+        except OSError:
+            pass
+
+    def reprobe(self, fingerprint, cameras, on_change, in_use):
+        """
+        Probe devices again, update cache and report cameras to on_change if they differ from cached ones.
+        Devices the app is capturing from can't be opened a second time, they keep their cached entry
+        """
+        busy = in_use()
+        found = self.probe_all([index for index, name in fingerprint if index not in busy])
+        # Cameras may have been opened while probing
+        busy |= in_use()
+        for index in busy:
+            if index in cameras:
+                found[index] = cameras[index]
+        for index, modes in found.items():
+            if not modes and index in cameras:
+                # Device opened but couldn't be configured, another app is capturing from it
+                found[index] = cameras[index]
+        if found != cameras:
+            self.save_cache(fingerprint, found)
+            if on_change:
+                on_change(found)
+
+    def revalidate(self, on_change=None, in_use=set):
+        """
+        Check cameras discover returned from cache in background, on_change is called from another thread.
+        in_use returns indices of devices currently open
+        """
+        if self.cached:
+            self.revalidate_thread = Thread(target=self.reprobe, args=self.cached + (on_change, in_use), daemon=True)
+            self.revalidate_thread.start()
+            self.cached = None
+
+    def discover(self, max_cameras=5):
+        """
+        Return capabilities of all available cameras as {index: {resolution: fps}}
+        """
+        fingerprint = [list(device) for device in self.enumerate_devices(max_cameras)]
+        cache = self.load_cache()
+        if cache and cache.get('fingerprint') == fingerprint:
+            # Same devices as last time, use cached capabilities right away
+            cameras = {int(index): camera['modes'] for index, camera in cache['cameras'].items()}
+            # Devices may have changed their capabilities or left without changing the device nodes
+            self.cached = (fingerprint, dict(cameras))
+            return cameras
+        cameras = self.probe_all([index for index, name in fingerprint])
+        self.save_cache(fingerprint, cameras)
+        return cameras
+
+    def __init__(self, backend):
+        self.backend = backend
+        config_dir = ConfigUtils.get_config_dir()
+        self.cache_file = os.path.join(config_dir, Settings.CAMERA_CACHE_FILE)
+        self.cached = None
+        self.revalidate_thread = None
@@ -0,0 +1,106 @@
+from multiprocessing import shared_memory
+from threading import Lock
+import numpy as np
+
+
+class FramePool:
+    """
+    Fixed ring of preallocated frame slots which captured frames are read into.
+    Slots are handed out by index, each carrying a sequence number and monotonic timestamp.
+    Sequence numbers work like a seqlock: capture invalidates a slot before overwriting it,
+    so readers check the number again after using a frame to know it wasn't torn.
+    A shared pool lives in shared memory so encoder processes can attach to it by name
+    """
+
+    def next_slot(self):
+        """
+        Return index of the slot the next frame gets captured into
+        """
+        return (self.latest + 1) % self.size
+
+    def commit(self, index, timestamp):
+        """
+        Mark slot as holding a new frame and return its sequence number
+        """
+        with self.lock:
+            self.seq += 1
+            self.seqs[index] = self.seq
+            self.timestamps[index] = timestamp
+            self.latest = index
+        return self.seq
+
+    def invalidate(self, index):
+        # Slot is about to be overwritten
+        with self.lock:
+            self.seqs[index] = -1
+
+    def valid(self, index, seq):
+        return self.seqs[index] == seq
+
+    def get(self, index, seq):
+        """
+        Return frame in slot if it hasn't been overwritten since, None otherwise.
+        Frame is not a copy, callers check valid() once they're done with it
+        """
+        if self.seqs[index] != seq:
+            return None
+        return self.frames[index]
+
+    def copy(self, index, seq, out=None):
+        """
+        Copy frame in slot into out, return it or None if slot was overwritten before or while copying
+        """
+        frame = self.get(index, seq)
+        if frame is None:
+            return None
+        if out is None:
+            out = frame.copy()
+        else:
+            out[:] = frame
+        return out if self.valid(index, seq) else None
+
+    def info(self):
+        """
+        Arguments needed to attach to shared pool from another process
+        """
+        return self.size, self.resolution, self.channels, self.shm.name
+
+    def close(self):
+        if self.shm is None:
+            return
+        # Arrays must be released before shared memory can be closed
+        del self.frames, self.seqs, self.timestamps
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+        self.shm = None
+
+    def __init__(self, size, resolution, channels=3, shared=False, shm_name=None):
+        width, height = resolution
+        self.size = size
+        self.resolution = resolution
+        self.channels = channels
+
+        frame_shape = (size, height, width, channels)
+        self.shm = None
+        self.owner = shm_name is None
+        if shared or shm_name:
+            frames_size = size * height * width * channels
+            if shm_name:
+                self.shm = shared_memory.SharedMemory(name=shm_name)
+            else:
+                self.shm = shared_memory.SharedMemory(create=True, size=frames_size + size * 16)
+            buf = self.shm.buf
+            self.frames = np.ndarray(frame_shape, dtype=np.uint8, buffer=buf)
+            self.seqs = np.ndarray(size, dtype=np.int64, buffer=buf, offset=frames_size)
+            self.timestamps = np.ndarray(size, dtype=np.float64, buffer=buf, offset=frames_size + size * 8)
+            if self.owner:
+                self.seqs.fill(-1)
+        else:
+            self.frames = np.zeros(frame_shape, dtype=np.uint8)
+            self.seqs = np.full(size, -1, dtype=np.int64)
+            self.timestamps = np.zeros(size, dtype=np.float64)
+
+        self.seq = -1
+        self.latest = -1
+        self.lock = Lock()
@@ -1,8 +1,16 @@
-from threading import Thread
-import sounddevice as sd
+from time import monotonic, perf_counter
 import numpy as np
 
+# PortAudio may be missing on machines only recording from synthetic or file sources
+try:
+    import sounddevice as sd
+except (ImportError, OSError):
+    sd = None
+
 from Recorder.AudioRecorder import AudioRecorder
+from Devices.AudioAnalyzer import AudioAnalyzer
+from Recorder.Metrics import registry, Histogram
+import Config.Settings as Settings
 
 
 class Microphone:
@@ -13,6 +21,8 @@ class Microphone:
     @staticmethod
     def get_input_devices():
         # Retrieve available audio input devices
+        if sd is None:
+            return {}
         devices = sd.query_devices()
         input_devices = {}
         for device in devices:
@@ -20,45 +30,79 @@ class Microphone:
                 input_devices[device['name']] = device['index']
         return input_devices
 
-    @staticmethod
-    def calculate_volume(in_data):
-        # Calculate volume from audio data
-        rms = np.sqrt(np.mean(in_data ** 2))
-        if rms > 0:
-            volume = 20 * np.log10(rms)
-        else:
-            volume = -np.inf
-        return volume
-
     def callback(self, in_data, frames, time, status):
-        self.volume = self.calculate_volume(in_data)
+        started = perf_counter()
+        if status and status.input_overflow:
+            # Samples were lost before they reached us
+            self.xruns += 1
+        # Capture time of first sample on the shared monotonic clock
+        if time.inputBufferAdcTime:
+            timestamp = time.inputBufferAdcTime + self.clock_offset
+        else:
+            timestamp = monotonic() - frames / self.samplerate
+        self.analyzer.analyze(in_data)
+        self.volume = self.analyzer.volume
+        if self.trigger:
+            self.level = self.trigger.level(self.analyzer)
+            self.trigger.process(self.analyzer, timestamp)
+        else:
+            self.level = self.volume
         if self.recorder.is_recording:
-            self.recorder.add_audio_chunk(in_data)
-        self.recorder.buffer_audio_chunk(in_data)
+            self.recorder.add_audio_chunk(in_data, timestamp)
+        self.recorder.buffer_audio_chunk(in_data, timestamp)
+        self.callback_time.observe(perf_counter() - started)
 
-    def record(self, out_path):
+    def metrics(self):
+        labels = {'device': 'default' if self.device_index is None else self.device_index}
+        yield 'camrec_audio_callback_seconds', labels, self.callback_time
+        yield 'camrec_audio_xruns_total', labels, self.xruns
+        yield 'camrec_audio_level_db', labels, self.volume
+        yield from self.recorder.metrics(labels)
+
+    def record(self, out_path, start_time=None, muxer=None):
         if self.recorder.is_recording:
             return
-        self.recorder.record = True
-        Thread(target=self.recorder.save_file, args=[out_path], daemon=True).start()
+        self.recorder.start(start_time)
+        self.recorder.save_file(out_path, muxer)
 
-    def stop_recording(self):
-        self.recorder.record = False
+    def stop_recording(self, stop_time=None):
+        self.recorder.stop(stop_time)
 
     def close(self):
         # Close audio stream
+        registry.unregister(self)
         self.stream.close()
 
-    def __init__(self, device_index):
+    def __init__(self, device_index, trigger=None, source=None):
+        self.device_index = device_index
         self.volume = -np.inf
-        self.stream = sd.InputStream(device=device_index, blocksize=2048, callback=self.callback)
+        # Level trigger compares against its threshold, e.g. peak rather than RMS
+        self.level = -np.inf
+        self.trigger = trigger
+        self.xruns = 0
+        self.callback_time = Histogram()
+        if source is None:
+            self.stream = sd.InputStream(device=device_index, blocksize=Settings.AUDIO_BLOCKSIZE,
+                                         callback=self.callback)
+            self.name = sd.query_devices(self.stream.device)['name']
+        else:
+            # Synthetic or file source standing in for a sound card
+            source.callback = self.callback
+            self.stream = source
+            self.name = type(source).__name__
 
         # Initialize Audio recorder
         samplerate = int(self.stream.samplerate)
         channels = int(self.stream.channels)
-        self.recorder = AudioRecorder(samplerate, channels, 5)
+        self.samplerate = samplerate
+        self.channels = channels
+        self.recorder = AudioRecorder(samplerate, channels, Settings.PREROLL_DURATION)
+        self.analyzer = AudioAnalyzer(samplerate, channels)
 
+        # Offset between stream time and monotonic clock used for video frames
+        self.clock_offset = monotonic() - self.stream.time
         self.stream.start()
+        registry.register(self)
 
     def __enter__(self):
         return self
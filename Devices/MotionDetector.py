@@ -0,0 +1,59 @@
+import numpy as np
+import cv2
+
+import Config.Settings as Settings
+
+
+class MotionDetector:
+    """
+    Detects motion by comparing a small grayscale copy of each frame against a running average background
+    """
+
+    def build_mask(self, regions):
+        """
+        Mask ignoring regions given as (x, y, width, height) fractions of the frame
+        """
+        width, height = self.size
+        mask = np.full((height, width), 255, dtype=np.uint8)
+        for x, y, w, h in regions:
+            mask[int(y * height):int((y + h) * height), int(x * width):int((x + w) * width)] = 0
+        return mask
+
+    def detect(self, frame):
+        """
+        Return True if frame contains a moving blob of at least minimum area
+        """
+        # Linear downscaling only samples the full frame, blurring the small copy suppresses noise instead
+        cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        cv2.GaussianBlur(self.gray, (5, 5), 0, dst=self.gray)
+        if self.background is None:
+            self.background = self.gray.astype(np.float32)
+            return False
+
+        cv2.convertScaleAbs(self.background, dst=self.reference)
+        cv2.absdiff(self.gray, self.reference, dst=self.diff)
+        cv2.threshold(self.diff, self.sensitivity, 255, cv2.THRESH_BINARY, dst=self.diff)
+        cv2.bitwise_and(self.diff, self.mask, dst=self.diff)
+        cv2.accumulateWeighted(self.gray, self.background, Settings.MOTION_ADAPTION)
+
+        # Cheap check before labelling blobs
+        if cv2.countNonZero(self.diff) < self.min_area:
+            return False
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(self.diff, connectivity=8)
+        # Label 0 is background
+        return bool(count > 1 and stats[1:, cv2.CC_STAT_AREA].max() >= self.min_area)
+
+    def __init__(self, size=Settings.MOTION_SIZE, sensitivity=Settings.MOTION_SENSITIVITY,
+                 min_area=Settings.MOTION_MIN_AREA, mask=Settings.MOTION_MASK):
+        width, height = size
+        self.size = size
+        self.sensitivity = sensitivity
+        self.min_area = max(1, int(min_area * width * height))
+        self.mask = self.build_mask(mask)
+
+        self.small = np.empty((height, width, 3), dtype=np.uint8)
+        self.gray = np.empty((height, width), dtype=np.uint8)
+        self.reference = np.empty((height, width), dtype=np.uint8)
+        self.diff = np.empty((height, width), dtype=np.uint8)
+        self.background = None
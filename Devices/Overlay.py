@@ -0,0 +1,105 @@
+from time import time, localtime, strftime
+import numpy as np
+import cv2
+
+import Config.Settings as Settings
+
+
+class Overlay:
+    """
+    HUD drawn into captured frames. Text is rasterised into a small cached bitmap
+    at most once per refresh interval, frames only get that region blended in
+    """
+
+    def hud_segments(self):
+        """
+        Text segments and their BGR colors making up the HUD
+        """
+        fields = Settings.OVERLAY_FIELDS
+        segments = []
+        if 'time' in fields:
+            segments.append((strftime('%d.%m.%Y %H:%M:%S', localtime(self.rendered_at)), (255, 255, 255)))
+        if 'camera' in fields and self.name:
+            segments.append((self.name, (255, 255, 255)))
+        if 'volume' in fields and self.volume is not None and np.isfinite(self.volume):
+            segments.append(('%d dB' % round(self.volume), (255, 255, 255)))
+        if 'rec' in fields and self.recording:
+            segments.append(('REC', (0, 0, 255)))
+        return segments
+
+    def render(self):
+        """
+        Rasterise HUD into cached premultiplied color bitmap and alpha mask
+        """
+        segments = self.hud_segments()
+        spacing = self.text_size(' ')[0] * 2
+        sizes = [self.text_size(text) for text, color in segments]
+        width = sum(w for w, h in sizes) + spacing * max(0, len(sizes) - 1)
+        ascent = max((h for w, h in sizes), default=0)
+        height = ascent + self.baseline + self.thickness
+
+        frame_height, frame_width = self.frame_shape
+        x, y = self.text_pos
+        # Clip HUD region to frame
+        top = max(0, y - ascent)
+        width = max(0, min(width, frame_width - x))
+        height = max(0, min(height, frame_height - top))
+        self.roi = (slice(top, top + height), slice(x, x + width))
+
+        # Text drawn onto black is premultiplied by its own coverage
+        color = np.zeros((height, width, 3), dtype=np.uint8)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        offset = 0
+        for (text, text_color), (w, h) in zip(segments, sizes):
+            origin = (offset, y - top)
+            cv2.putText(color, text, origin, self.font, self.font_size, text_color, self.thickness, cv2.LINE_AA)
+            cv2.putText(mask, text, origin, self.font, self.font_size, 255, self.thickness, cv2.LINE_AA)
+            offset += w + spacing
+
+        self.glyph = color.astype(np.uint16)
+        self.inv_alpha = (255 - mask).astype(np.uint16)[:, :, np.newaxis]
+        self.work = np.empty((height, width, 3), dtype=np.uint16)
+        self.rendered_key = self.render_key()
+
+    def render_key(self):
+        # HUD only needs to be rasterised again when any of these change
+        return int(time() / Settings.OVERLAY_REFRESH), self.name, self.recording
+
+    def text_size(self, text):
+        return cv2.getTextSize(text, self.font, self.font_size, self.thickness)[0]
+
+    def apply(self, frame):
+        """
+        Blend cached HUD into frame in place
+        """
+        if self.render_key() != self.rendered_key:
+            self.rendered_at = time()
+            self.render()
+        roi = frame[self.roi]
+        if roi.size == 0:
+            return
+        # roi = roi * (1 - alpha) + premultiplied color
+        np.multiply(roi, self.inv_alpha, out=self.work)
+        np.floor_divide(self.work, 255, out=self.work)
+        np.add(self.work, self.glyph, out=self.work)
+        np.copyto(roi, self.work, casting='unsafe')
+
+    def __init__(self, resolution, name=''):
+        width, height = resolution
+        self.frame_shape = (height, width)
+        self.name = name
+
+        # Fields updated from outside
+        self.volume = None
+        self.recording = False
+
+        # Font settings scale with resolution
+        self.text_pos = (int(width * 0.01), int(height * 0.05))
+        self.font = cv2.FONT_HERSHEY_SIMPLEX
+        self.font_size = width / 1280
+        self.thickness = max(1, int(width / 480))
+        self.baseline = cv2.getTextSize('Ag', self.font, self.font_size, self.thickness)[1]
+
+        self.roi = (slice(0, 0), slice(0, 0))
+        self.rendered_at = 0
+        self.rendered_key = None
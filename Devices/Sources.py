@@ -0,0 +1,208 @@
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from threading import Thread
+from time import monotonic, sleep
+import soundfile as sf
+import numpy as np
+import cv2
+
+# Mirrors the time info sounddevice hands to stream callbacks
+BlockTime = namedtuple('BlockTime', 'inputBufferAdcTime')
+
+
+class Pacer:
+    """
+    Sleeps until the next tick of a fixed rate, or not at all when running as fast as possible
+    """
+
+    def wait(self):
+        if not self.realtime:
+            return
+        self.next_tick += self.interval
+        delay = self.next_tick - monotonic()
+        if delay > 0:
+            sleep(delay)
+        elif delay < -self.interval:
+            # Fell behind, don't try to catch up with a burst
+            self.next_tick = monotonic()
+
+    def __init__(self, rate, realtime=True):
+        self.interval = 1 / rate
+        self.realtime = realtime
+        self.next_tick = monotonic()
+
+
+class SyntheticVideo:
+    """
+    Generates a moving test pattern, used by Camera in place of cv2.VideoCapture
+    """
+
+    def grab(self):
+        self.pacer.wait()
+        self.frame_count += 1
+        return True
+
+    def retrieve(self, image=None):
+        width = self.resolution[0]
+        offset = self.frame_count * self.speed % width
+        if image is None or image.shape != self.pattern.shape[:1] + (width, 3):
+            image = np.empty((self.resolution[1], width, 3), dtype=np.uint8)
+        image[:] = self.pattern[:, offset:offset + width]
+        return True, image
+
+    def read(self, image=None):
+        self.grab()
+        return self.retrieve(image)
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        pass
+
+    def __init__(self, resolution, fps=30, realtime=True, speed=8):
+        self.resolution = resolution
+        self.speed = speed
+        self.frame_count = 0
+        self.pacer = Pacer(fps, realtime)
+
+        # Pattern twice the frame width, every frame is a shifted window of it
+        width, height = resolution
+        x = np.arange(width * 2) % width
+        y = np.arange(height)
+        self.pattern = np.empty((height, width * 2, 3), dtype=np.uint8)
+        self.pattern[..., 0] = (x * 255 // width)[np.newaxis, :]
+        self.pattern[..., 1] = (y * 255 // height)[:, np.newaxis]
+        self.pattern[..., 2] = ((x[np.newaxis, :] // 64 + y[:, np.newaxis] // 64) % 2) * 255
+
+
+class FileVideo:
+    """
+    Plays a video file in a loop, used by Camera in place of cv2.VideoCapture
+    """
+
+    def grab(self):
+        self.pacer.wait()
+        if self.cap.grab():
+            return True
+        # Start over at end of file
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        return self.cap.grab()
+
+    def retrieve(self, image=None):
+        ret, frame = self.cap.retrieve(image=self.frame)
+        if not ret:
+            return False, None
+        self.frame = frame
+        if image is None or image.shape[:2] != (self.resolution[1], self.resolution[0]):
+            image = np.empty((self.resolution[1], self.resolution[0], 3), dtype=np.uint8)
+        cv2.resize(frame, self.resolution, dst=image)
+        return True, image
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        return self.retrieve(image)
+
+    def set(self, prop, value):
+        return False
+
+    def release(self):
+        self.cap.release()
+
+    def __init__(self, path, resolution, fps=None, realtime=True):
+        self.resolution = resolution
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise IOError('Could not open video file %s' % path)
+        self.frame = None
+        # Play at the file's own frame rate unless told otherwise
+        self.pacer = Pacer(fps or self.cap.get(cv2.CAP_PROP_FPS) or 30, realtime)
+
+
+class AudioSource(ABC):
+    """
+    Stands in for a sounddevice input stream, calls back with blocks from a reader thread.
+    Block timestamps follow the sample count, so they stay exact when running faster than real time
+    """
+
+    @property
+    def time(self):
+        return self.start_time + self.sample_count / self.samplerate
+
+    @abstractmethod
+    def fill(self, block):
+        pass
+
+    def run(self):
+        block = np.zeros((self.blocksize, self.channels), dtype=np.float32)
+        while self.running:
+            self.pacer.wait()
+            self.fill(block)
+            self.callback(block, self.blocksize, BlockTime(self.time), None)
+            self.sample_count += self.blocksize
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def __init__(self, samplerate, channels, blocksize, realtime=True, callback=None):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.callback = callback
+
+        self.running = False
+        self.start_time = monotonic()
+        self.sample_count = 0
+        self.pacer = Pacer(samplerate / blocksize, realtime)
+        self.thread = Thread(target=self.run, daemon=True)
+
+
+class SyntheticAudio(AudioSource):
+    """
+    Quiet noise floor interrupted by loud tone bursts, so the trigger has something to react to
+    """
+
+    def fill(self, block):
+        block[:] = self.rng.normal(0, self.noise, block.shape)
+        # Bursts close every interval, so pre-roll is filled by the time the first one triggers
+        position = self.sample_count / self.samplerate % self.burst_interval if self.burst_interval else -1
+        if position >= self.burst_interval - self.burst_duration:
+            t = (self.sample_count + np.arange(len(block))) / self.samplerate
+            block += (self.burst * np.sin(2 * np.pi * 1000 * t))[:, np.newaxis]
+
+    def __init__(self, samplerate=48000, channels=1, blocksize=2048, realtime=True, callback=None,
+                 noise_level=-50, burst_level=-6, burst_interval=10, burst_duration=2):
+        super().__init__(samplerate, channels, blocksize, realtime, callback)
+        self.noise = 10 ** (noise_level / 20)
+        self.burst = 10 ** (burst_level / 20)
+        self.burst_interval = burst_interval
+        self.burst_duration = burst_duration
+        self.rng = np.random.default_rng(0)
+
+
+class FileAudio(AudioSource):
+    """
+    Plays a sound file in a loop
+    """
+
+    def fill(self, block):
+        read = self.file.read(len(block), dtype='float32', always_2d=True, out=block)
+        if len(read) < len(block):
+            # Start over at end of file
+            self.file.seek(0)
+            self.file.read(len(block) - len(read), dtype='float32', always_2d=True, out=block[len(read):])
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+    def __init__(self, path, blocksize=2048, realtime=True, callback=None):
+        self.file = sf.SoundFile(path)
+        super().__init__(self.file.samplerate, self.file.channels, blocksize, realtime, callback)
@@ -1,10 +1,10 @@
-from datetime import datetime, timedelta
+from threading import Thread, Lock
+from queue import SimpleQueue, Empty
 import tkinter.ttk as ttk
 import tkinter as tk
-import os
+import logging
 
-from Devices.Camera import Camera
-from Devices.Microphone import Microphone
+from Recorder.Metrics import start_server, startup
 
 from GUI.WindowEvents import WindowEvents
 from GUI.WindowUtils import WindowUtils
@@ -13,10 +13,14 @@ from Config.ConfigHandler import ConfigHandler
 from Config import ConfigUtils
 import Config.Settings as Settings
 
+log = logging.getLogger(__name__)
+
 
 class MainWindow:
     """
-    Main Tkinter GUI
+    Main Tkinter GUI.
+    Window shows before heavy libraries are imported, devices are listed and opened by background workers
+    and the UI fills in as they complete. Device modules are therefore imported where they're used
     """
 
     @staticmethod
@@ -45,86 +49,362 @@ class MainWindow:
         self.audio_meter.coords(self.volume, 0, meter_height, Settings.AUDIO_METER_WIDTH, height)
         self.audio_meter.itemconfig(self.volume, fill=color)
 
-    def start_recording(self):
-        output = self.output.get()
-        date_time = datetime.now() - timedelta(seconds=5)
-        filename = date_time.strftime('%d-%m-%Y %H-%M-%S')
-        video_out = os.path.join(output, filename + '.mkv')
-        audio_out = os.path.join(output, filename + '.wav')
-        self.cam.record(video_out)
-        self.mic.record(audio_out)
+    def start_recording(self, trigger_time):
+        # Called by trigger engine outside of Tk thread, devices are only replaced while holding the lock
+        with self.devices_lock:
+            if self.cams and self.mic:
+                self.events.start(self.cams, self.mic, self.output_path, trigger_time, self.trigger.start_source)
+
+    def stop_recording(self, stop_time=None):
+        self.events.stop(stop_time)
 
-    def stop_recording(self):
-        self.cam.stop_recording()
-        self.mic.stop_recording()
+    def finish_event(self):
+        # Event recording from devices about to be replaced is written first, called with devices lock held
+        self.events.stop()
+        self.events.wait()
 
-    def update_rec_status(self, volume):
+    def update_rec_status(self):
         """
-        Update recording status based on volume
+        Update recording status shown in preview from trigger engine
         """
+        self.trigger.threshold = self.threshold.get()
         if self.rec_status:
-            rec_status = None
-            if volume >= self.threshold.get():
-                rec_status = 2
-                if self.last_trigger is None:
-                    self.start_recording()
-                self.last_trigger = datetime.now()
-            elif self.last_trigger:
-                duration = datetime.now() - self.last_trigger
-                if duration.total_seconds() > 5:
-                    rec_status = 1
-                    self.stop_recording()
-                    self.last_trigger = None
-            if rec_status:
+            rec_status = 2 if self.trigger.active else 1
+            if rec_status != self.rec_status:
                 self.rec_status = rec_status
-                self.cam.rec_status = rec_status
+                for cam in self.cams:
+                    cam.rec_status = rec_status
 
     def update_preview(self):
         """
         Update video feed for preview
         """
-        frame = self.cam.retrieve_preview(self.preview_size)
+        # Only redraws when a camera captured a new frame
+        frame = self.mosaic.update(self.cams, self.preview_size)
         if frame:
-            self.preview.imgtk = frame
-            self.preview.itemconfig(self.cam_stream, image=frame)
+            if frame is not self.preview.imgtk:
+                # Preview image is reused until preview gets resized
+                self.preview.imgtk = frame
+                self.preview.itemconfig(self.cam_stream, image=frame)
 
             # Place image in center of canvas
             width, height = self.preview_size
             self.preview.coords(self.cam_stream, width / 2, height / 2)
 
-            volume = self.mic.volume
-            self.update_rec_status(volume)
+        # Status and meter keep updating while cameras deliver no frames or are being replaced
+        volume = self.mic.volume if self.mic else Settings.AUDIO_CLAMP
+        self.update_rec_status()
+        for cam in self.cams:
+            cam.overlay.volume = volume
+        # Meter shows level the trigger compares against threshold slider
+        self.update_meter(self.mic.level if self.mic else Settings.AUDIO_CLAMP)
+
+        # Checked again once fastest camera captured its next frame
+        fps = max((cam.mode['fps'] or Settings.PREVIEW_FPS for cam in self.cams), default=Settings.PREVIEW_FPS)
+        self.preview.after(max(1, round(1000 / fps)), self.update_preview)
 
-            # Update volume meter
-            self.update_meter(volume)
-        # Schedule next frame update
-        self.preview.after(40, self.update_preview)
+    def selected_cameras(self, cam_index=None, available_cameras=None):
+        """
+        Return indices of cameras selected in camera menu, or of given menu entry
+        """
+        if cam_index is None:
+            cam_index = self.cam_index.get()
+        if cam_index == Settings.ALL_CAMERAS:
+            return list(self.available_cameras if available_cameras is None else available_cameras)
+        return [int(cam_index)]
+
+    def open_cameras(self, cam_indices, resolution, overlay_enabled, encoder_pool):
+        """
+        Open cameras off the Tk thread, encoder calibration may take several seconds
+        """
+        from Devices.Camera import Camera
+        from Recorder.Encoders import select_preset
+
+        # Each camera captures on its own thread, encoding is shared by the encoder pool
+        cams = [Camera(cam_index, resolution, overlay_enabled, encoder=encoder_pool, trigger=self.trigger)
+                for cam_index in cam_indices]
+        # Cheapest encoder keeping up is found once per resolution, frame rate granted by cameras and camera count
+        fps = max((cam.mode['fps'] or 30 for cam in cams), default=30)
+        preset = select_preset(resolution, fps, len(cams))
+        for cam in cams:
+            cam.recorder.preset = preset
+        return cams
 
     def init_camera(self):
-        if self.available_cameras:
-            cam_index = int(self.cam_index.get())
+        if self.available_cameras and not self.cameras_opening:
+            cam_indices = self.selected_cameras()
             resolution = self.resolution.get()
-            if self.cam:
-                # Don't initialize new cam if settings haven't changed
-                if cam_index == self.cam.cam_index and resolution == self.cam.resolution:
+            if self.cams:
+                # Don't initialize new cams if settings haven't changed
+                if cam_indices == [cam.cam_index for cam in self.cams] and resolution == self.cams[0].resolution:
                     return
-                self.cam.close()
-            self.cam = Camera(cam_index, resolution, self.overlay_enabled.get())
+            # Menus stay disabled until new cameras are open
+            self.cameras_opening = True
+            self.cam_menu.state(['disabled'])
+            self.res_menu.state(['disabled'])
+            self.preview_label.config(text='Opening cameras...')
+            with self.devices_lock:
+                # No event starts from cameras about to be replaced
+                old_cams, self.cams = self.cams, []
+            self.camera_thread = Thread(target=self.reopen_cameras,
+                                        args=[old_cams, cam_indices, resolution, self.overlay_enabled.get(),
+                                              self.encoder_pool])
+            self.camera_thread.start()
+
+    def reopen_cameras(self, old_cams, cam_indices, resolution, overlay_enabled, encoder_pool):
+        cams = []
+        try:
+            with self.devices_lock:
+                self.finish_event()
+            for cam in old_cams:
+                cam.close()
+            cams = self.open_cameras(cam_indices, resolution, overlay_enabled, encoder_pool)
+        except Exception:
+            log.exception('Failed to open cameras')
+        self.post(lambda: self.cameras_ready(cams), *[cam.close for cam in cams])
+
+    def cameras_ready(self, cams):
+        with self.devices_lock:
+            self.cams = cams
+            # Armed cameras fill their pre-roll
+            for cam in cams:
+                cam.rec_status = self.rec_status
+                cam.overlay_enabled = self.overlay_enabled.get()
+        self.cameras_opening = False
+        self.cam_menu.state(['!disabled'])
+        self.res_menu.state(['!disabled'])
+        self.preview_label.config(text='Preview' if cams else 'Failed to open cameras')
+        if self.ready and self.trigger and self.mic and cams:
+            self.start_button.state(['!disabled'])
+        self.winEvent.on_resize()
 
     def init_microphone(self):
-        if self.mic:
-            self.mic.close()
         device_name = self.input_device_name.get()
         device_index = self.input_devices[device_name]
+        if device_index == self.device_index and self.mic:
+            return
         self.device_index = device_index
-        self.mic = Microphone(self.device_index)
+        # Menu stays disabled until new microphone is open
+        self.mic_menu.state(['disabled'])
+        with self.devices_lock:
+            # No event starts from microphone about to be replaced
+            old_mic, self.mic = self.mic, None
+        self.mic_thread = Thread(target=self.reopen_microphone, args=[old_mic, device_index])
+        self.mic_thread.start()
+
+    def reopen_microphone(self, old_mic, device_index):
+        mic = None
+        try:
+            from Devices.Microphone import Microphone
+
+            with self.devices_lock:
+                self.finish_event()
+            if old_mic:
+                old_mic.close()
+            mic = Microphone(device_index, self.trigger)
+        except Exception:
+            log.exception('Failed to open microphone')
+        self.post(lambda: self.microphone_ready(mic), *([mic.close] if mic else []))
+
+    def microphone_ready(self, mic):
+        with self.devices_lock:
+            self.mic = mic
+        self.mic_menu.state(['!disabled'])
+        if self.ready and self.trigger and self.cams and mic:
+            self.start_button.state(['!disabled'])
+
+    def load_devices(self, resolution, overlay_enabled, find_output):
+        """
+        Import libraries and open devices off the Tk thread, devices and UI updates are handed over through
+        worker queue
+        """
+        try:
+            startup.import_modules(Settings.STARTUP_IMPORTS)
+            with startup.measure('import device modules'):
+                from Recorder.Events import EventRecorder
+                from Recorder.Trigger import TriggerEngine
+                from Recorder.LiveView import start_live_view
+                from GUI.PreviewMosaic import PreviewMosaic
+            self.mosaic = PreviewMosaic()
+            # Trigger engine runs in audio callback, recording is started from its dispatch thread
+            self.trigger = TriggerEngine(0, self.start_recording, self.stop_recording)
+            self.events = EventRecorder()
+            self.live_view = start_live_view(self)
+
+            # Audio and video devices are opened side by side
+            workers = [Thread(target=self.load_audio),
+                       Thread(target=self.load_video, args=[resolution, overlay_enabled])]
+            for worker in workers:
+                worker.start()
+            if find_output:
+                # Runs xdg-user-dir on Linux
+                with startup.measure('find documents folder'):
+                    documents_path = str(ConfigUtils.get_documents_dir())
+                self.post(lambda: self.output_found(documents_path))
+            for worker in workers:
+                worker.join()
+        except Exception:
+            log.exception('Failed to initialize devices')
+        self.post(self.devices_ready)
+
+    def load_audio(self):
+        input_devices, device_name, mic = {}, None, None
+        try:
+            from Devices.Microphone import Microphone
+
+            with startup.measure('list audio devices'):
+                input_devices = Microphone.get_input_devices()
+            device_name = self.confHandler.input_device(input_devices)
+            if device_name is not None:
+                with startup.measure('open microphone'):
+                    mic = Microphone(input_devices[device_name], self.trigger)
+        except Exception:
+            log.exception('Failed to open microphone')
+        self.post(lambda: self.audio_ready(input_devices, device_name, mic), *([mic.close] if mic else []))
+
+    def load_video(self, resolution, overlay_enabled):
+        available_cameras, cam_index, cams, encoder_pool = [], None, [], None
+        try:
+            from Devices.Camera import Camera
+            from Recorder.EncoderPool import EncoderPool
+
+            with startup.measure('probe cameras'):
+                available_cameras = Camera.get_available_cameras()
+            cam_index = self.confHandler.camera_index(available_cameras)
+            if available_cameras:
+                if Settings.ENCODER_PROCESSES:
+                    with startup.measure('start encoder pool'):
+                        encoder_pool = EncoderPool(Settings.ENCODER_PROCESSES)
+                with startup.measure('open cameras'):
+                    cams = self.open_cameras(self.selected_cameras(cam_index, available_cameras), resolution,
+                                             overlay_enabled, encoder_pool)
+        except Exception:
+            log.exception('Failed to open cameras')
+        closers = [cam.close for cam in cams] + ([encoder_pool.shutdown] if encoder_pool else [])
+        self.post(lambda: self.video_ready(available_cameras, cam_index, cams, encoder_pool), *closers)
+        if available_cameras:
+            # Cached cameras are checked once menu is filled, so changes are applied after it
+            Camera.revalidate_cameras(lambda cameras: self.post(lambda: self.cameras_changed(cameras)))
+
+    def output_found(self, documents_path):
+        # Unless user picked a folder in the meantime
+        if not self.output.get():
+            self.output.set(documents_path)
+
+    def audio_ready(self, input_devices, device_name, mic):
+        # Fill in audio device menu, microphone was opened by worker
+        with self.devices_lock:
+            self.mic = mic
+        self.input_devices = input_devices
+        self.input_device_names = list(input_devices)
+        if device_name is None:
+            self.input_device_name.set('No audio device found')
+            return
+        self.device_index = input_devices[device_name]
+        self.input_device_name.set(device_name)
+        self.mic_menu.set_menu(device_name, *self.input_device_names)
+        self.mic_menu.state(['!disabled'])
+
+    def fill_camera_menu(self, available_cameras, cam_index):
+        cam_options = list(available_cameras)
+        if len(cam_options) > 1:
+            cam_options.append(Settings.ALL_CAMERAS)
+        self.cam_index.set(cam_index)
+        self.cam_menu.set_menu(cam_index, *cam_options)
+
+    def video_ready(self, available_cameras, cam_index, cams, encoder_pool):
+        # Fill in camera menu and start preview, cameras were opened by worker
+        with self.devices_lock:
+            self.cams = cams
+            self.encoder_pool = encoder_pool
+        self.available_cameras = available_cameras
+        if available_cameras:
+            self.fill_camera_menu(available_cameras, cam_index)
+            self.cam_menu.state(['!disabled'])
+            self.preview_label.config(text='Preview' if cams else 'Failed to open cameras')
+            self.winEvent.on_resize()
+        else:
+            if cam_index is not None:
+                self.cam_index.set(cam_index)
+            self.preview_label.config(text='No video device found')
+        # Cameras may still turn up while probing in background
+        self.update_preview()
+
+    def cameras_changed(self, available_cameras):
+        """
+        Apply cameras found by probing in background when they differ from cached ones
+        """
+        self.available_cameras = available_cameras
+        if not available_cameras:
+            self.cam_menu.state(['disabled'])
+            self.preview_label.config(text='No video device found')
+            return
+        cam_index = self.cam_index.get()
+        if cam_index != Settings.ALL_CAMERAS and cam_index not in map(str, available_cameras):
+            # Selected camera is gone
+            cam_index = available_cameras[0]
+        self.fill_camera_menu(available_cameras, cam_index)
+        if not self.cameras_opening:
+            self.cam_menu.state(['!disabled'])
+            # Reopens cameras if selection changed
+            self.init_camera()
+
+    def devices_ready(self):
+        self.ready = True
+        if self.trigger and self.mic and self.cams:
+            self.start_button.state(['!disabled'])
+        startup.mark('devices ready')
+        log.info('Startup times:\n%s', startup.report())
+
+    def post(self, update, *closers):
+        """
+        Hand update over to Tk thread, called by workers. Closers release devices the update takes over,
+        they run instead if the window closes first
+        """
+        with self.devices_lock:
+            if not self.closing:
+                self.worker_queue.put((update, closers))
+                return
+        for close in closers:
+            close()
+
+    def poll_workers(self):
+        """
+        Apply results of background workers on Tk thread
+        """
+        while True:
+            try:
+                update, closers = self.worker_queue.get_nowait()
+            except Empty:
+                break
+            update()
+        self.window.after(Settings.WORKER_POLL_INTERVAL, self.poll_workers)
 
     def __init__(self):
-        self.cam = None
+        self.cams = []
         self.mic = None
-        self.last_trigger = None
+        self.encoder_pool = None
+        self.available_cameras = []
+        # Held while cameras or microphone are replaced, trigger starts events from another thread
+        self.devices_lock = Lock()
+        # Created by startup worker
+        self.trigger = None
+        self.events = None
+        self.live_view = None
+        self.mosaic = None
+        self.metrics_server = start_server()
         self.rec_status = 0
 
+        # Background workers hand UI updates to Tk thread
+        self.worker_queue = SimpleQueue()
+        self.startup_thread = None
+        self.ready = False
+        # Devices picked in menus are opened by workers as well
+        self.camera_thread = None
+        self.cameras_opening = False
+        self.mic_thread = None
+        self.closing = False
+
         widget_opts = {
             'fg': Settings.WINDOW_FG_COLOR,
             'bg': Settings.WINDOW_BG_COLOR,
@@ -178,7 +458,8 @@ class MainWindow:
 
         # --------------- Top frame ---------------
 
-        self.preview_label = tk.Label(self.top_frame, text='Preview', font=font_large, **widget_opts)
+        self.preview_label = tk.Label(self.top_frame, text='Scanning for video devices...', font=font_large,
+                                      **widget_opts)
         self.preview_label.pack(side='left')
 
         self.threshold_label = tk.Label(self.top_frame, text='Threshold', font=font_large, **widget_opts)
@@ -191,6 +472,7 @@ class MainWindow:
         self.preview_frame.pack(side='left', fill='both', expand=True)
 
         self.preview = tk.Canvas(self.preview_frame, bg='black', highlightthickness=0)
+        self.preview.imgtk = None
         self.preview.place(relx=.5, rely=.5, anchor='center')
 
         # Volume meter with fixed width on the right
@@ -223,31 +505,32 @@ class MainWindow:
         camera_label = tk.Label(self.bottom_frame, text='Camera', font=font_small, **widget_opts)
         camera_label.grid(row=0, column=1, sticky='w', padx=(0, padding))
 
+        # Filled in once cameras are probed
         self.cam_index = tk.StringVar(value='-')
-        self.available_cameras = Camera.get_available_cameras()
-        if self.available_cameras:
-            self.cam_index.set(self.available_cameras[0])
-        cam_menu = ttk.OptionMenu(self.bottom_frame, self.cam_index, self.cam_index.get(), *self.available_cameras,
-                                  command=lambda cam: self.init_camera())
-        cam_menu.grid(row=0, column=2, sticky='we', padx=(0, padding))
+        self.cam_menu = ttk.OptionMenu(self.bottom_frame, self.cam_index, self.cam_index.get(),
+                                       command=lambda cam: self.init_camera())
+        self.cam_menu.state(['disabled'])
+        self.cam_menu.grid(row=0, column=2, sticky='we', padx=(0, padding))
 
         # Audio device selection
 
         mic_label = tk.Label(self.bottom_frame, text='Audio', font=font_small, **widget_opts)
         mic_label.grid(row=0, column=3, sticky='w', padx=(0, padding))
 
-        # retrieve all audio input devices
-        self.input_devices = Microphone.get_input_devices()
+        # Filled in once audio input devices are listed
+        self.input_devices = {}
+        self.input_device_names = []
+        self.input_device_name = tk.StringVar(value='-')
+        self.device_index = None
 
-        self.input_device_names = list(self.input_devices.keys())
-        self.input_device_name = tk.StringVar(value=self.input_device_names[0])
-        self.device_index = self.input_devices[self.input_device_name.get()]
-
-        mic_menu = ttk.OptionMenu(self.bottom_frame, self.input_device_name, self.input_device_names[0],
-                                  *self.input_device_names[1:], command=lambda mic: self.init_microphone())
-        mic_menu.grid(row=0, column=4, sticky='we', padx=(0, padding))
+        self.mic_menu = ttk.OptionMenu(self.bottom_frame, self.input_device_name, self.input_device_name.get(),
+                                       command=lambda mic: self.init_microphone())
+        self.mic_menu.state(['disabled'])
+        self.mic_menu.grid(row=0, column=4, sticky='we', padx=(0, padding))
 
+        # Enabled once devices are open
         self.start_button = ttk.Button(self.bottom_frame, text='Start', command=self.winEvent.toggle_recording)
+        self.start_button.state(['disabled'])
         self.start_button.grid(row=0, column=5, sticky='w', padx=(0, padding))
 
         # ------------- Second column ------------
@@ -270,8 +553,11 @@ class MainWindow:
         output_label = tk.Label(self.bottom_frame, text='Output', font=font_small, **widget_opts)
         output_label.grid(row=1, column=3, sticky='w', padx=(0, padding))
 
-        documents_path = ConfigUtils.get_documents_dir()
-        self.output = tk.StringVar(value=documents_path)
+        # Documents folder is looked up by startup worker unless config sets output
+        self.output = tk.StringVar(value='')
+        # Plain copy of output path, readable outside of Tk thread
+        self.output_path = ''
+        self.output.trace_add('write', lambda *args: setattr(self, 'output_path', self.output.get()))
         output_text = ttk.Entry(self.bottom_frame, textvariable=self.output, state='readonly')
         output_text.grid(row=1, column=4, sticky='we', padx=(0, padding))
 
@@ -305,23 +591,57 @@ class MainWindow:
         # Update threshold line once after applying config
         self.winEvent.update_thres()
 
-        self.init_microphone()
-        if self.available_cameras:
-            self.init_camera()
-            self.update_preview()
-
         # Adjust window size
         default_win_geometry = self.winUtil.get_default_window_geometry()
         self.window.minsize(*default_win_geometry[:2])
         self.window.geometry('%dx%d+%d+%d' % default_win_geometry)
 
         loading_text.destroy()
+        startup.mark('window built')
+        self.window.after_idle(startup.mark, 'window shown')
+
+        # Devices are opened in the background, menus and preview fill in as they become available
+        self.startup_thread = Thread(target=self.load_devices, daemon=True,
+                                     args=[self.resolution.get(), self.overlay_enabled.get(), not self.output.get()])
+        self.startup_thread.start()
+        self.poll_workers()
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.cam:
-            self.cam.close()
-        self.mic.close()
-        self.confHandler.save_config()
+        # Window may be closed while devices are still being opened
+        with self.devices_lock:
+            self.closing = True
+        if self.startup_thread:
+            self.startup_thread.join()
+        if self.camera_thread:
+            self.camera_thread.join()
+        if self.mic_thread:
+            self.mic_thread.join()
+        # Devices handed over by workers after the last poll
+        while True:
+            try:
+                update, closers = self.worker_queue.get_nowait()
+            except Empty:
+                break
+            for close in closers:
+                close()
+        # Finish event being recorded before devices go away
+        if self.trigger:
+            self.trigger.close()
+        if self.events:
+            self.events.close()
+        if self.live_view:
+            self.live_view.close()
+        for cam in self.cams:
+            cam.close()
+        if self.encoder_pool:
+            self.encoder_pool.shutdown()
+        if self.mic:
+            self.mic.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+        # Menus only hold real devices once startup finished
+        if self.ready:
+            self.confHandler.save_config()
@@ -0,0 +1,45 @@
+from PIL import Image, ImageTk
+import numpy as np
+
+from GUI.WindowUtils import WindowUtils
+
+
+class PreviewMosaic:
+    """
+    Composites previews of all cameras into a single reused PhotoImage
+    """
+
+    def update(self, cams, size):
+        """
+        Redraw tiles of cameras with new frames, return PhotoImage or None if nothing changed
+        """
+        width, height = size
+        columns, rows = WindowUtils.mosaic_grid(len(cams))
+        tile_width, tile_height = width // columns, height // rows
+        if self.buffer is None or self.buffer.shape[:2] != (height, width):
+            # Preview size changed
+            self.buffer = np.zeros((height, width, 3), dtype=np.uint8)
+            self.image = None
+
+        changed = False
+        for i, cam in enumerate(cams):
+            tile = cam.retrieve_preview((tile_width, tile_height))
+            if tile is None:
+                continue
+            x = (i % columns) * tile_width
+            y = (i // columns) * tile_height
+            self.buffer[y:y + tile_height, x:x + tile_width] = tile
+            changed = True
+        if not changed and self.image is not None:
+            return
+
+        image = Image.fromarray(self.buffer)
+        if self.image is None:
+            self.image = ImageTk.PhotoImage(image=image)
+        else:
+            self.image.paste(image)
+        return self.image
+
+    def __init__(self):
+        self.buffer = None
+        self.image = None
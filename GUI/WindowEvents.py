@@ -55,10 +55,8 @@ class WindowEvents:
         """
         Toggle datetime overlay being displayed in video feed
         """
-        if self.main.overlay_enabled.get():
-            self.main.cam.overlay_enabled = True
-        else:
-            self.main.cam.overlay_enabled = False
+        for cam in self.main.cams:
+            cam.overlay_enabled = self.main.overlay_enabled.get()
 
     def toggle_recording(self):
         """
@@ -68,10 +66,13 @@ class WindowEvents:
             # Disable recording
             rec_status = 0
             self.main.start_button.config(text='Start')
-            self.main.stop_recording()
+            # Stops running recording through trigger engine
+            self.main.trigger.disarm()
         else:
             # Enable recording
             rec_status = 1
             self.main.start_button.config(text='Stop')
+            self.main.trigger.arm()
         self.main.rec_status = rec_status
-        self.main.cam.rec_status = rec_status
+        for cam in self.main.cams:
+            cam.rec_status = rec_status
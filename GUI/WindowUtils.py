@@ -1,5 +1,6 @@
+from math import ceil, sqrt
 from Config import Settings
-from PIL import Image, ImageTk
+import tkinter as tk
 import os
 
 
@@ -12,13 +13,23 @@ class WindowUtils:
         # MainWindow class
         self.main = MainWindow
 
+    @staticmethod
+    def mosaic_grid(count):
+        """
+        Return columns and rows of preview mosaic for number of cameras
+        """
+        columns = max(1, ceil(sqrt(count)))
+        rows = max(1, ceil(count / columns))
+        return columns, rows
+
     def get_preview_size(self):
         """
         Determine maximum preview size maintaining its aspect ratio
         """
-        # determine aspect ratio
+        # determine aspect ratio of camera mosaic
         width, height = map(int, self.main.resolution.get().split('x'))
-        aspect_ratio = width / height
+        columns, rows = self.mosaic_grid(len(self.main.cams))
+        aspect_ratio = width * columns / (height * rows)
 
         # Calculate width including audio meter
         audio_meter_width = Settings.AUDIO_METER_WIDTH + self.main.threshold_slider.winfo_width()
@@ -84,9 +95,8 @@ class WindowUtils:
             # Windows
             self.main.window.iconbitmap(Settings.ICON_PATH_WIN)
         else:
-            # Linux / UNIX / macOS
-            icon = Image.open(Settings.ICON_PATH_UNIX)
-            icon = ImageTk.PhotoImage(icon)
+            # Linux / UNIX / macOS, Tk reads PNG itself so PIL isn't needed before the window shows
+            icon = tk.PhotoImage(file=Settings.ICON_PATH_UNIX)
             self.main.window.iconphoto(True, icon)
 
     def get_window_size(self):
@@ -0,0 +1,157 @@
+from configparser import ConfigParser
+from threading import Event
+import logging
+import signal
+import os
+
+from Devices.Camera import Camera
+from Devices.Microphone import Microphone
+from Recorder.EncoderPool import EncoderPool
+from Recorder.Events import EventRecorder
+from Recorder.Trigger import TriggerEngine
+from Recorder.Metrics import start_server, startup
+from Recorder.LiveView import start_live_view
+from Recorder.Encoders import select_preset
+
+from Config import ConfigUtils
+import Config.Settings as Settings
+
+log = logging.getLogger(__name__)
+
+
+class Daemon:
+    """
+    Records events without GUI or preview, driven by command line arguments and config file
+    """
+
+    @staticmethod
+    def load_config(config_file=None):
+        """
+        Read settings from config file, falling back to the one written by the GUI
+        """
+        if config_file is None:
+            config_file = os.path.join(ConfigUtils.get_config_dir(), 'config.ini')
+        config = ConfigParser()
+        config.read(config_file)
+        # Camera index may also be a comma separated list or all cameras
+        cam_index = config.get('Cam', 'index', fallback=None)
+        if cam_index and cam_index != Settings.ALL_CAMERAS:
+            cam_index = [int(index) for index in cam_index.split(',')]
+        return {
+            'camera': cam_index,
+            'resolution': config.get('Cam', 'resolution', fallback=None),
+            'overlay': config.getboolean('Cam', 'hud', fallback=True),
+            'proxy': config.getboolean('Cam', 'proxy', fallback=Settings.PROXY_ENABLED),
+            'mic': config.getint('Mic', 'index', fallback=None),
+            'threshold': config.getint('Mic', 'threshold', fallback=None),
+            'output': config.get('Output', 'path', fallback=None)
+        }
+
+    def handle_signal(self, signum, frame):
+        log.info('Received signal %d, shutting down', signum)
+        self.stopped.set()
+
+    def set_rec_status(self, rec_status):
+        for cam in self.cams:
+            cam.rec_status = rec_status
+
+    def start_recording(self, trigger_time):
+        # Called by trigger engine's dispatch thread
+        log.info('Triggered, recording')
+        self.set_rec_status(2)
+        self.events.start(self.cams, self.mic, self.output, trigger_time, self.trigger.start_source)
+
+    def stop_recording(self, stop_time):
+        log.info('Recording stopped')
+        self.set_rec_status(1)
+        self.events.stop(stop_time)
+
+    def run(self):
+        """
+        Run until SIGINT or SIGTERM is received
+        """
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.handle_signal)
+        log.info('Listening on camera %s, threshold %d dB, output %s',
+                 ', '.join(str(cam.cam_index) for cam in self.cams), self.trigger.threshold, self.output)
+        self.trigger.arm()
+        # Trigger engine works from audio callback, nothing to do here but wait
+        while not self.stopped.wait(1):
+            pass
+        self.trigger.disarm()
+
+    def close(self):
+        # Finish event being recorded before devices go away
+        self.trigger.close()
+        self.events.close()
+        if self.live_view:
+            self.live_view.close()
+        for cam in self.cams:
+            cam.close()
+        if self.encoder_pool:
+            self.encoder_pool.shutdown()
+        if self.mic:
+            self.mic.close()
+        if self.metrics_server:
+            self.metrics_server.close()
+
+    def __init__(self, args):
+        self.cams = []
+        self.mic = None
+        self.encoder_pool = None
+        self.metrics_server = None
+        self.live_view = None
+        self.stopped = Event()
+
+        # Command line arguments take precedence over config file
+        config = self.load_config(args.config)
+        for key in config:
+            value = getattr(args, key, None)
+            if value is not None:
+                config[key] = value
+
+        cam_indices = config['camera']
+        if cam_indices is None or cam_indices == Settings.ALL_CAMERAS:
+            with startup.measure('probe cameras'):
+                available_cameras = Camera.get_available_cameras()
+            if not available_cameras:
+                raise RuntimeError('No video device found')
+            # Cameras are fixed once running, changes found in background only update the cache
+            Camera.revalidate_cameras(lambda cameras: log.info('Available cameras changed to %s', cameras))
+            cam_indices = available_cameras if cam_indices else available_cameras[:1]
+        resolution = config['resolution'] or Settings.RESOLUTIONS[0]
+        threshold = config['threshold']
+        if threshold is None:
+            threshold = Settings.HEADLESS_THRESHOLD
+        self.output = config['output'] or str(ConfigUtils.get_documents_dir())
+        self.trigger = TriggerEngine(threshold, self.start_recording, self.stop_recording)
+        self.events = EventRecorder()
+        metrics_port = getattr(args, 'metrics_port', None)
+        self.metrics_server = start_server(Settings.METRICS_PORT if metrics_port is None else metrics_port)
+
+        if Settings.ENCODER_PROCESSES:
+            self.encoder_pool = EncoderPool(Settings.ENCODER_PROCESSES)
+        with startup.measure('open microphone'):
+            self.mic = Microphone(config['mic'], self.trigger)
+        # All cameras are recorded on the same trigger
+        with startup.measure('open cameras'):
+            self.cams = [Camera(cam_index, resolution, config['overlay'], encoder=self.encoder_pool,
+                                trigger=self.trigger, proxy=config['proxy'])
+                         for cam_index in cam_indices]
+        # Encoder has to keep up with the frame rate cameras actually granted
+        fps = max(cam.mode['fps'] or 30 for cam in self.cams)
+        preset = select_preset(resolution, fps, len(self.cams))
+        for cam in self.cams:
+            cam.recorder.preset = preset
+        # Recording is always armed without GUI
+        self.set_rec_status(1)
+        live_port = getattr(args, 'live_port', None)
+        self.live_view = start_live_view(self, Settings.LIVE_PORT if live_port is None else live_port)
+        startup.mark('devices ready')
+        log.info('Startup times:\n%s', startup.report())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
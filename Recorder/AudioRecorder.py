@@ -1,44 +1,164 @@
-from collections import deque
-from time import sleep
+from math import inf, ceil
+import numpy as np
 import soundfile as sf
-import cv2
-
-
-class AudioRecorder:
-    def flush_buffer(self, out_file):
-        # Flush circular buffer
-        buffer = self.circ_buffer.copy()
-        for chunk in buffer:
-            out_file.write(chunk)
-
-    def save_file(self, out_path):
-        self.is_recording = True
-        query_interval = 1 / self.samplerate
-        with sf.SoundFile(out_path, mode='w', samplerate=self.samplerate,
-                          channels=self.channels, subtype='PCM_16') as out_file:
-            self.flush_buffer(out_file)
-            while self.record:
-                if len(self.audio_buffer) == 0:
-                    sleep(query_interval)
-                    continue
-                in_data = self.audio_buffer.popleft()
-                out_file.write(in_data)
-        self.is_recording = False
-
-    def add_audio_chunk(self, in_data):
-        self.audio_buffer.append(in_data)
-
-    def buffer_audio_chunk(self, in_data):
-        self.circ_buffer.append(in_data)
-
-    def __init__(self, samplerate, channels, buffer_duration=5, audio_buffer_size=1323000):
+
+from Recorder.Storage import preallocate, release
+from Recorder.PrerollBuffer import AudioRing
+from Recorder.WriterQueue import WriterQueue
+from Recorder.WriterPool import ClipWriter
+import Config.Settings as Settings
+
+# Extension, container and codec of each output format
+AUDIO_FORMATS = {
+    'wav': ('.wav', 'WAV', 'PCM_16'),
+    'flac': ('.flac', 'FLAC', 'PCM_16'),
+    'opus': ('.ogg', 'OGG', 'OPUS'),
+}
+OPUS_SAMPLERATES = (8000, 12000, 16000, 24000, 48000)
+
+
+class AudioRecorder(ClipWriter):
+    @staticmethod
+    def output_format(samplerate, name=Settings.AUDIO_FORMAT):
+        """
+        Return extension, container and codec for the configured format at given sample rate
+        """
+        if name == 'opus' and samplerate not in OPUS_SAMPLERATES:
+            name = 'flac'
+        return AUDIO_FORMATS.get(name, AUDIO_FORMATS['wav'])
+
+    def write_trimmed(self, write, in_data, timestamp, start_time):
+        """
+        Write chunk, cutting off samples before start time and after stop time
+        """
+        start, end = 0, len(in_data)
+        if start_time > timestamp:
+            start = round((start_time - timestamp) * self.samplerate)
+        if self.stop_time < timestamp + end / self.samplerate:
+            end = round((self.stop_time - timestamp) * self.samplerate)
+        if start < end:
+            write(in_data[start:end], timestamp + start / self.samplerate)
+            self.written()
+            self.measure(in_data[start:end])
+
+    def measure(self, in_data):
+        # Peak and energy of written audio, catalogued with the event
+        samples = in_data.ravel()
+        self.clip_peak = max(self.clip_peak, float(np.abs(samples).max()))
+        self.clip_energy += float(np.dot(samples, samples))
+        self.clip_frames += len(in_data)
+
+    def flush_buffer(self, write):
+        # Flush circular buffer straight from its memory, return time right after last flushed sample
+        end_time = self.start_time
+        for timestamp, view in self.circ_buffer.views(self.start_time):
+            self.write_trimmed(write, view, timestamp, self.start_time)
+            end_time = timestamp + len(view) / self.samplerate
+        return end_time
+
+    def write_batched(self, in_data, timestamp):
+        """
+        Collect blocks into batch buffer, file is only written once batch is full
+        """
+        while len(in_data):
+            count = min(len(in_data), len(self.batch) - self.batch_fill)
+            self.batch[self.batch_fill:self.batch_fill + count] = in_data[:count]
+            self.batch_fill += count
+            in_data = in_data[count:]
+            if self.batch_fill == len(self.batch):
+                self.flush_batch()
+
+    def flush_batch(self):
+        if self.batch_fill:
+            self.out_file.write(self.batch[:self.batch_fill])
+            self.batch_fill = 0
+
+    def write_block(self, in_data, timestamp):
+        if self.muxer:
+            self.muxer.write_audio(in_data, timestamp)
+        else:
+            self.write_batched(in_data, timestamp)
+
+    def open_clip(self):
+        if not self.muxer:
+            # Compression level is only understood by compressed formats
+            compression = None if self.format == 'WAV' else Settings.AUDIO_COMPRESSION
+            self.out_file = sf.SoundFile(self.out_path, mode='w', samplerate=self.samplerate, channels=self.channels,
+                                         format=self.format, subtype=self.subtype, compression_level=compression)
+            preallocate(self.out_path, self.reserve)
+        # Samples already written as part of circular buffer are cut off
+        self.flushed_until = self.flush_buffer(self.write_block)
+
+    def write_items(self, chunks):
+        for timestamp, in_data in chunks:
+            self.write_trimmed(self.write_block, in_data, timestamp, self.flushed_until)
+
+    def finish_clip(self):
+        if self.muxer:
+            # Container is only closed once every stream finished, even a failed one
+            self.muxer.finish_audio()
+            return
+        if self.out_file is None:
+            return
+        try:
+            self.flush_batch()
+        finally:
+            self.out_file.close()
+            self.out_file = None
+            self.batch_fill = 0
+            release(self.out_path)
+
+    def written(self):
+        super().written()
+        self.written_chunks += 1
+
+    def metrics(self, labels):
+        yield 'camrec_audio_blocks_written_total', labels, self.written_chunks
+        yield 'camrec_audio_blocks_dropped_total', labels, self.audio_queue.dropped
+        yield 'camrec_queue_depth', dict(labels, queue='audio'), len(self.audio_queue)
+        yield 'camrec_queue_max_depth', dict(labels, queue='audio'), self.audio_queue.max_depth
+
+    def add_audio_chunk(self, in_data, timestamp):
+        # Stream reuses its buffer after callback returns
+        self.audio_queue.put((timestamp, in_data.copy()))
+
+    def buffer_audio_chunk(self, in_data, timestamp):
+        self.circ_buffer.write(in_data, timestamp)
+
+    def start(self, start_time=None):
+        self.clip_frames = 0
+        self.clip_peak = 0
+        self.clip_energy = 0
+        super().start(start_time)
+
+    def clip_stats(self):
+        """
+        Sample frames written since recording was last started, their peak and summed energy
+        """
+        return {'frames': self.clip_frames, 'peak': self.clip_peak, 'energy': self.clip_energy}
+
+    @property
+    def dropped_chunks(self):
+        return self.audio_queue.dropped
+
+    def __init__(self, samplerate, channels, buffer_duration=5, queue_duration=Settings.AUDIO_QUEUE_DURATION,
+                 blocksize=Settings.AUDIO_BLOCKSIZE, batch_duration=Settings.AUDIO_WRITE_BATCH):
         self.samplerate = samplerate
         self.channels = channels
+        self.extension, self.format, self.subtype = self.output_format(samplerate)
 
-        self.record = False
-        self.is_recording = False
+        # Pre-roll sized from duration, writer queue holds queue duration worth of blocks
+        self.circ_buffer = AudioRing(samplerate, channels, buffer_duration)
+        self.audio_queue = WriterQueue(ceil(queue_duration * samplerate / blocksize))
+        self.written_chunks = 0
+        self.clip_frames = 0
+        self.clip_peak = 0
+        self.clip_energy = 0
 
-        self.buffer_size = 50000
-        self.circ_buffer = deque(maxlen=self.buffer_size)
-        self.audio_buffer = deque(maxlen=audio_buffer_size)
-        self.writer = cv2.VideoWriter_fourcc(*'XVID')
+        # Blocks are gathered into larger writes to keep encoder and disk busy less often
+        self.batch = np.zeros((max(blocksize, round(batch_duration * samplerate)), channels), dtype=np.float32)
+        self.batch_fill = 0
+        self.out_file = None
+        self.reserve = 0
+        self.flushed_until = -inf
+        super().__init__(self.audio_queue)
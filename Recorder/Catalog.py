@@ -0,0 +1,145 @@
+from threading import Lock
+import sqlite3
+import os
+
+from Recorder.Storage import read_index
+import Config.Settings as Settings
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    directory TEXT UNIQUE NOT NULL,
+    start REAL NOT NULL,
+    end REAL,
+    cameras TEXT,
+    microphone TEXT,
+    trigger TEXT,
+    peak_db REAL,
+    mean_db REAL,
+    size INTEGER NOT NULL DEFAULT 0,
+    complete INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS files (
+    event_id INTEGER NOT NULL REFERENCES events(id) ON DELETE CASCADE,
+    segment INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    start REAL,
+    duration REAL,
+    size INTEGER,
+    frames INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_start ON events(start);
+CREATE INDEX IF NOT EXISTS events_peak ON events(peak_db);
+CREATE INDEX IF NOT EXISTS files_event ON files(event_id);
+'''
+
+
+class Catalog:
+    """
+    SQLite catalog of the events in an output directory, one row per event and one per file.
+    Rows are written while events are recorded, event indexes on disk remain the source it's rebuilt from
+    """
+
+    def execute(self, query, parameters=()):
+        with self.lock:
+            cursor = self.connection.execute(query, parameters)
+            self.connection.commit()
+            return cursor
+
+    def begin(self, event_dir, index):
+        self.execute('INSERT OR REPLACE INTO events (directory, start, cameras, microphone, trigger) '
+                     'VALUES (?, ?, ?, ?, ?)',
+                     (os.path.basename(event_dir), index['start'], index.get('cameras'), index.get('microphone'),
+                      index.get('trigger')))
+
+    @staticmethod
+    def file_row(event_id, number, name, segment, file):
+        if isinstance(file, str):
+            # Indexes written before files carried their size and frame count
+            file = {'name': file, 'size': None, 'frames': None}
+        return (event_id, number, os.path.join(name, file['name']), segment['start'], segment['duration'],
+                file['size'], file['frames'])
+
+    def add_segment(self, event_dir, number, segment):
+        """
+        Add files of a closed segment and extend event up to its end
+        """
+        name = os.path.basename(event_dir)
+        with self.lock:
+            event_id, = self.connection.execute('SELECT id FROM events WHERE directory = ?', (name,)).fetchone()
+            self.connection.executemany(
+                'INSERT INTO files (event_id, segment, path, start, duration, size, frames) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [self.file_row(event_id, number, name, segment, file) for file in segment['files']])
+            self.connection.execute('UPDATE events SET end = ?, size = size + ? WHERE id = ?',
+                                    (segment['start'] + segment['duration'], segment.get('size', 0), event_id))
+            self.connection.commit()
+
+    def finish(self, event_dir, index):
+        self.execute('UPDATE events SET end = ?, peak_db = ?, mean_db = ?, complete = ? WHERE directory = ?',
+                     (index.get('end'), index.get('peak_db'), index.get('mean_db'), index.get('complete', False),
+                      os.path.basename(event_dir)))
+
+    def remove(self, event_dir):
+        self.execute('DELETE FROM events WHERE directory = ?', (os.path.basename(event_dir),))
+
+    def find(self, since=None, until=None, min_db=None):
+        """
+        Return events overlapping time range (seconds since epoch) whose peak reached min_db, oldest first
+        """
+        query = 'SELECT * FROM events WHERE 1'
+        parameters = []
+        if since is not None:
+            query += ' AND coalesce(end, start) >= ?'
+            parameters.append(since)
+        if until is not None:
+            query += ' AND start <= ?'
+            parameters.append(until)
+        if min_db is not None:
+            query += ' AND peak_db >= ?'
+            parameters.append(min_db)
+        rows = self.execute(query + ' ORDER BY start', parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    def files(self, event_id):
+        rows = self.execute('SELECT * FROM files WHERE event_id = ? ORDER BY segment, path', (event_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def rebuild(self):
+        """
+        Recreate catalog from event indexes in output directory, return number of events found
+        """
+        self.execute('DELETE FROM events')
+        count = 0
+        with os.scandir(self.output) as entries:
+            for entry in entries:
+                index = read_index(entry.path) if entry.is_dir() else None
+                if not index:
+                    continue
+                self.begin(entry.path, index)
+                for number, segment in enumerate(index['segments'], 1):
+                    self.add_segment(entry.path, number, segment)
+                self.finish(entry.path, index)
+                count += 1
+        return count
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __init__(self, output):
+        self.output = output
+        self.lock = Lock()
+        # Shared by writer threads, access is serialised by lock
+        self.connection = sqlite3.connect(os.path.join(output, Settings.CATALOG_FILE), check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # Queries from other processes don't block recording
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA foreign_keys=ON')
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,280 @@
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from queue import Full
+from threading import Thread, Condition
+from itertools import count
+from time import perf_counter
+import logging
+import numpy as np
+import cv2
+
+from Recorder.Storage import release
+from Recorder.Encoders import open_writer
+from Recorder.Metrics import Histogram
+from Devices.FramePool import FramePool
+import Config.Settings as Settings
+
+log = logging.getLogger(__name__)
+
+
+def attach(pools, pool_info):
+    """
+    Attach shared frame pool, each pool is mapped once per process however many files use it
+    """
+    name = pool_info[-1]
+    if name not in pools:
+        pool = FramePool(*pool_info[:3], shm_name=name)
+        # Pool, copy of frame being encoded and number of open files reading from pool
+        pools[name] = [pool, np.empty_like(pool.frames[0]), 0]
+    pools[name][2] += 1
+    return pools[name]
+
+
+def detach(pools, name):
+    # Mapping is closed with the last file using it, cameras replaced by new ones don't stay mapped
+    entry = pools[name]
+    entry[2] -= 1
+    if not entry[2]:
+        entry[0].close()
+        del pools[name]
+
+
+def fail(writer, error):
+    # Rest of the file is skipped, error is reported when it gets closed
+    log.error('Encoding %s failed: %s', writer['path'], error)
+    writer['error'] = str(error)
+
+
+def write_frame(writer, frame, repeat):
+    """
+    Write frame after repeating the last written one to fill the gap before it.
+    Frame is None if its slot got overwritten, the last frame then takes its place as well
+    """
+    last = writer['last']
+    if frame is None:
+        writer['stale'] += 1
+        if last is None:
+            return
+        repeat += 1
+        writer['duplicated'] += 1
+    started = perf_counter()
+    for _ in range(repeat):
+        # Clip starting with a gap repeats its first frame
+        writer['file'].write(frame if last is None else last)
+    if frame is not None:
+        writer['file'].write(frame)
+        if last is None:
+            writer['last'] = last = np.empty_like(frame)
+        np.copyto(last, frame)
+        writer['written'] += 1
+    writer['encode_time'].observe(perf_counter() - started)
+
+
+def encode_worker(jobs, results):
+    """
+    Encoder process, reads frames from shared frame pools and writes them to video files.
+    Only slot indices and sequence numbers are passed through the job queue, along with how often
+    the previous frame is repeated before a frame. Errors only affect the file they occur in,
+    every closed file gets a result
+    """
+    pools = {}
+    writers = {}
+    while True:
+        job = jobs.get()
+        cmd, job_id = job[:2]
+        if cmd == 'quit':
+            break
+        if cmd == 'open':
+            pool_info, out_path, preset, fps, reserve = job[2:]
+            writer = {'pool': attach(pools, pool_info), 'name': pool_info[-1], 'path': out_path, 'file': None,
+                      'last': None, 'written': 0, 'stale': 0, 'duplicated': 0, 'encode_time': Histogram(),
+                      'error': None}
+            writers[job_id] = writer
+            try:
+                writer['file'] = open_writer(out_path, preset, fps, writer['pool'][0].resolution, reserve=reserve)
+                if not writer['file'].isOpened():
+                    raise OSError('could not open video file')
+            except Exception as error:
+                fail(writer, error)
+            continue
+
+        writer = writers.get(job_id)
+        if writer is None:
+            # Job of a previous process that died
+            continue
+        if cmd == 'close':
+            try:
+                if writer['file'] is not None:
+                    writer['file'].release()
+            except Exception as error:
+                fail(writer, error)
+            release(writer['path'])
+            detach(pools, writer['name'])
+            del writers[job_id]
+            results.send((job_id, writer['written'], writer['stale'], writer['duplicated'], writer['encode_time'],
+                          writer['error']))
+            continue
+        if writer['error']:
+            continue
+        pool, frame_copy = writer['pool'][:2]
+        try:
+            if cmd == 'frame':
+                # Copied first, capture may overwrite slot while frame is encoded
+                index, seq, repeat = job[2:]
+                write_frame(writer, pool.copy(index, seq, frame_copy), repeat)
+            elif cmd == 'jpeg':
+                # Pre-roll frames compressed in capture process
+                data, repeat = job[2:]
+                write_frame(writer, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR), repeat)
+        except Exception as error:
+            fail(writer, error)
+
+    for pool, frame_copy, files in pools.values():
+        pool.close()
+
+
+class EncoderPool:
+    """
+    Pool of encoder processes shared by all cameras, frames are passed by shared memory slot
+    """
+
+    def collect_results(self):
+        while not self.closing:
+            with self.condition:
+                readers = [reader for reader in self.results if reader is not None]
+            for reader in wait(readers, Settings.ENCODER_CHECK_INTERVAL):
+                try:
+                    result = reader.recv()
+                except (EOFError, OSError):
+                    # Encoder process died, it is replaced right away
+                    with self.condition:
+                        if reader in self.results:
+                            self.results[self.results.index(reader)] = None
+                        reader.close()
+                        self.check_workers()
+                    continue
+                job_id = result[0]
+                with self.condition:
+                    # Jobs lost with a process that died already count as finished
+                    if job_id in self.job_workers and job_id not in self.finished:
+                        self.finished[job_id] = result[1:]
+                        self.condition.notify_all()
+
+    def check_workers(self):
+        """
+        Replace encoder processes that died, files they were writing are lost. Called with condition held
+        """
+        for worker, process in enumerate(self.processes):
+            if process.is_alive() or self.closing:
+                continue
+            log.error('Encoder process %d died with exit code %s, restarting it', worker, process.exitcode)
+            for job_id, job_worker in self.job_workers.items():
+                if job_worker == worker and job_id not in self.finished:
+                    self.finished[job_id] = (0, 0, 0, Histogram(), 'encoder process died')
+            self.start_worker(worker)
+        self.condition.notify_all()
+
+    def start_worker(self, worker):
+        # Fresh queue and pipe, a process that died may have left the old ones locked or half written
+        self.jobs[worker] = self.context.Queue(Settings.ENCODER_QUEUE_SIZE)
+        reader, writer = self.context.Pipe(duplex=False)
+        self.processes[worker] = self.context.Process(target=encode_worker, args=(self.jobs[worker], writer),
+                                                      daemon=True)
+        self.processes[worker].start()
+        # Only the encoder process holds the sending end, so its exit shows up as end of file
+        writer.close()
+        self.results[worker] = reader
+
+    def open(self, pool, out_path, preset, fps, reserve=0):
+        """
+        Assign a new video file to the least busy encoder process, return job id
+        """
+        with self.condition:
+            self.check_workers()
+            worker = min(range(len(self.processes)), key=lambda i: self.active[i])
+            self.active[worker] += 1
+            job_id = next(self.job_ids)
+            self.job_workers[job_id] = worker
+        self.send(job_id, ('open', job_id, pool.info(), out_path, preset, fps, reserve))
+        return job_id
+
+    def send(self, job_id, job):
+        # Job queues are bounded, writers wait for a busy encoder while a dead one gets replaced
+        while True:
+            try:
+                self.jobs[self.job_workers[job_id]].put(job, timeout=Settings.ENCODER_CHECK_INTERVAL)
+                return
+            except Full:
+                with self.condition:
+                    self.check_workers()
+                    if job_id in self.finished:
+                        return
+
+    def write(self, job_id, index, seq, repeat=0):
+        """
+        Encode frame in slot of shared frame pool, after repeating the previous frame to fill a gap
+        """
+        self.send(job_id, ('frame', job_id, index, seq, repeat))
+
+    def write_compressed(self, job_id, data, repeat=0):
+        self.send(job_id, ('jpeg', job_id, data.tobytes(), repeat))
+
+    def close(self, job_id):
+        """
+        Finalize video file and wait for encoder, return frames written, dropped as stale and duplicated
+        in their place, and histogram of encode times. Raise RuntimeError if the file couldn't be written
+        """
+        worker = self.job_workers[job_id]
+        self.send(job_id, ('close', job_id))
+        with self.condition:
+            while job_id not in self.finished:
+                # Encoder process may have died, its result would never arrive
+                if not self.condition.wait(Settings.ENCODER_CHECK_INTERVAL):
+                    self.check_workers()
+            self.active[worker] -= 1
+            del self.job_workers[job_id]
+            written, stale, duplicated, encode_time, error = self.finished.pop(job_id)
+        if error:
+            raise RuntimeError('Encoder failed: %s' % error)
+        return written, stale, duplicated, encode_time
+
+    def shutdown(self):
+        with self.condition:
+            self.closing = True
+        for jobs in self.jobs:
+            try:
+                jobs.put(('quit', None), timeout=Settings.ENCODER_SHUTDOWN_TIMEOUT)
+            except Full:
+                # Encoder is stuck, it gets terminated below
+                pass
+        for process in self.processes:
+            process.join(Settings.ENCODER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                log.warning('Encoder process did not quit, terminating it')
+                process.terminate()
+        self.result_thread.join()
+
+    def __init__(self, workers=1):
+        # Spawn keeps encoder processes free of Tk and capture state on all platforms
+        self.context = get_context('spawn')
+        # Every encoder process has its own job queue and result pipe
+        self.jobs = [None] * workers
+        self.results = [None] * workers
+        self.processes = [None] * workers
+        self.closing = False
+        for worker in range(workers):
+            self.start_worker(worker)
+
+        self.job_ids = count()
+        self.job_workers = {}
+        self.active = [0] * workers
+        self.finished = {}
+        self.condition = Condition()
+        self.result_thread = Thread(target=self.collect_results, daemon=True)
+        self.result_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
@@ -0,0 +1,181 @@
+from tempfile import TemporaryDirectory
+from fractions import Fraction
+from time import perf_counter
+import logging
+import json
+import os
+import numpy as np
+import cv2
+
+try:
+    import av
+    # Raised by PyAV when a codec or container can't be used
+    CODEC_ERRORS = (av.FFmpegError, ValueError, OSError)
+except ImportError:
+    av = None
+    CODEC_ERRORS = (ValueError, OSError)
+
+from Devices.Sources import SyntheticVideo
+from Recorder.Storage import preallocate
+from Config import ConfigUtils
+import Config.Settings as Settings
+
+log = logging.getLogger(__name__)
+
+
+def add_stream(container, preset, fps, resolution):
+    """
+    Add video stream encoded with given preset to PyAV container
+    """
+    settings = Settings.ENCODER_PRESETS[preset]
+    width, height = resolution
+    # Measured frame rates aren't whole numbers
+    stream = container.add_stream(settings['codec'], rate=Fraction(fps).limit_denominator(1001))
+    stream.width = width
+    stream.height = height
+    stream.pix_fmt = settings.get('pix_fmt', 'yuv420p')
+    stream.options = dict(settings.get('options', {}))
+    return stream
+
+
+class AvWriter:
+    """
+    Constant frame rate video file written through PyAV, for codecs OpenCV can't write or tune.
+    Mirrors the parts of cv2.VideoWriter recorders use
+    """
+
+    def isOpened(self):
+        return self.stream is not None
+
+    def write(self, frame):
+        video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+        video_frame.pts = self.pts
+        video_frame.time_base = self.time_base
+        self.pts += 1
+        packets = self.stream.encode(video_frame)
+        if packets:
+            self.container.mux(packets)
+            if self.reserve:
+                # PyAV only creates the file once the first packet is written
+                preallocate(self.out_path, self.reserve)
+                self.reserve = 0
+
+    def release(self):
+        if self.stream is None:
+            return
+        for packet in self.stream.encode(None):
+            self.container.mux(packet)
+        self.container.close()
+        self.stream = None
+
+    def __init__(self, out_path, preset, fps, resolution, reserve=0):
+        self.out_path = out_path
+        self.reserve = reserve
+        self.container = av.open(out_path, mode='w')
+        self.stream = add_stream(self.container, preset, fps, resolution)
+        self.time_base = 1 / Fraction(fps).limit_denominator(1001)
+        self.stream.codec_context.time_base = self.time_base
+        self.pts = 0
+
+
+def available(preset, muxed=False):
+    # Presets without an OpenCV fourcc, and muxed output, are encoded by PyAV
+    settings = Settings.ENCODER_PRESETS.get(preset)
+    if settings is None:
+        return False
+    if muxed or 'fourcc' not in settings:
+        return av is not None
+    return True
+
+
+def open_writer(out_path, preset, fps, resolution, use_av=False, reserve=0):
+    """
+    Open constant frame rate video file, through OpenCV where the preset allows it as that's cheapest.
+    Reserve bytes are preallocated as soon as the file exists
+    """
+    settings = Settings.ENCODER_PRESETS[preset]
+    if 'fourcc' in settings and not use_av:
+        writer = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*settings['fourcc']), fps, resolution)
+        preallocate(out_path, reserve)
+        return writer
+    return AvWriter(out_path, preset, fps, resolution, reserve)
+
+
+def calibration_frames(resolution, count=8):
+    # Moving test pattern with sensor-like noise, a clean pattern would compress unrealistically well
+    source = SyntheticVideo(resolution, realtime=False)
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(count):
+        ret, frame = source.read()
+        noise = rng.integers(-8, 9, frame.shape, dtype=np.int16)
+        frames.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def measure(preset, resolution, fps, frames, out_path, muxed=False):
+    """
+    Return frames per second preset encodes on this machine, 0 if it can't be opened
+    """
+    try:
+        writer = open_writer(out_path, preset, fps, resolution, muxed)
+    except CODEC_ERRORS:
+        return 0
+    if not writer.isOpened():
+        return 0
+    # First frame initialises the codec and isn't counted
+    writer.write(frames[0])
+    started = perf_counter()
+    for index in range(Settings.CALIBRATION_FRAMES):
+        writer.write(frames[index % len(frames)])
+    writer.release()
+    return Settings.CALIBRATION_FRAMES / (perf_counter() - started)
+
+
+def calibrate(resolution, fps, streams=1, muxed=False):
+    """
+    Return first preset in calibration order that encodes all streams at frame rate with headroom
+    """
+    required = fps * streams * Settings.CALIBRATION_HEADROOM
+    frames = calibration_frames(resolution)
+    with TemporaryDirectory() as temp_dir:
+        for preset in Settings.CALIBRATION_ORDER:
+            if not available(preset, muxed):
+                continue
+            rate = measure(preset, resolution, fps, frames, os.path.join(temp_dir, preset + '.mkv'), muxed)
+            log.info('Encoder preset %s: %.1f fps at %dx%d, %.1f fps required', preset, rate, *resolution, required)
+            if rate >= required:
+                return preset
+    return Settings.CALIBRATION_ORDER[-1]
+
+
+def select_preset(resolution, fps=30, streams=1):
+    """
+    Return configured encoder preset, calibrating once per machine and setup if it is 'auto'
+    """
+    preset = Settings.VIDEO_PRESET
+    if preset != 'auto':
+        return preset
+    if isinstance(resolution, str):
+        resolution = tuple(int(value) for value in resolution.split('x'))
+    muxed = Settings.MUX_OUTPUT and av is not None
+    key = '%dx%d %g fps %d streams%s' % (resolution + (fps, streams, ' muxed' if muxed else ''))
+
+    cache_file = os.path.join(ConfigUtils.get_config_dir(), Settings.ENCODER_CACHE_FILE)
+    try:
+        with open(cache_file) as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        cache = {}
+    if available(cache.get(key), muxed):
+        return cache[key]
+
+    preset = calibrate(resolution, fps, streams, muxed)
+    cache[key] = preset
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w') as file:
+            json.dump(cache, file, indent=2)
+    except OSError:
+        pass
+    return preset
@@ -0,0 +1,288 @@
+from datetime import datetime
+from threading import Thread, Event, Lock
+from time import monotonic, sleep, time
+from math import inf, log10
+import os
+
+from Recorder.Storage import RetentionManager, write_index
+from Recorder.Catalog import Catalog
+from Recorder.Muxer import Muxer
+from Recorder.VideoRecorder import VideoRecorder
+from Recorder.Thumbnails import write_thumbnails
+import Config.Settings as Settings
+
+
+def start_event(cams, mic, base_path, start_time, reserve=None):
+    """
+    Start recording from all cameras and microphone into files named after base path.
+    Data captured before monotonic start time is cut off, return paths of files being written
+    along with the recorders writing into them. Reserve maps file name suffixes to bytes
+    preallocated for them. Proxies of cameras are written next to main clips
+    """
+    reserve = reserve or {}
+    video_out = base_path + '.mkv'
+    audio_out = base_path + mic.recorder.extension
+    muxed = Settings.MUX_OUTPUT and Muxer.available()
+    if muxed and (mic.recorder.is_recording or any(cam.writing() for cam in cams)):
+        # Previous event is still being written
+        return {}
+    files = {}
+    for cam in cams:
+        if cam.proxy:
+            name = ' cam%d' % cam.cam_index if len(cams) > 1 else ''
+            proxy_out = base_path + name + Settings.PROXY_SUFFIX + '.mkv'
+            cam.proxy.reserve = reserve.get(proxy_out[len(base_path):], 0)
+            cam.record_proxy(proxy_out, start_time)
+            files[proxy_out] = [cam.proxy]
+    if muxed:
+        # Audio and all videos go into one container, timed by the shared monotonic clock
+        muxer = Muxer(video_out, start_time, reserve.get('.mkv', 0))
+        streams = [muxer.add_video_stream(cam.pool.resolution, cam.recorder.fps, cam.recorder.preset) for cam in cams]
+        muxer.add_audio_stream(mic.samplerate, mic.channels)
+        for cam, stream in zip(cams, streams):
+            cam.record(video_out, start_time, muxer, stream)
+        mic.record(audio_out, start_time, muxer)
+        files[video_out] = [cam.recorder for cam in cams] + [mic.recorder]
+        return files
+    for cam in cams:
+        if len(cams) > 1:
+            video_out = '%s cam%d.mkv' % (base_path, cam.cam_index)
+        cam.recorder.reserve = reserve.get(video_out[len(base_path):], 0)
+        cam.record(video_out, start_time)
+        files[video_out] = [cam.recorder]
+    mic.recorder.reserve = reserve.get(mic.recorder.extension, 0)
+    mic.record(audio_out, start_time)
+    files[audio_out] = [mic.recorder]
+    return files
+
+
+def stop_event(cams, mic, stop_time=None):
+    """
+    Stop recording, data captured after monotonic stop time is discarded
+    """
+    for cam in cams:
+        cam.stop_recording(stop_time)
+    mic.stop_recording(stop_time)
+
+
+def wait_written(cams, mic):
+    # Writers drain their queues after being stopped, meanwhile new data only goes to pre-roll
+    while mic.recorder.is_recording or any(cam.writing() for cam in cams):
+        sleep(0.05)
+
+
+def wall_time(timestamp):
+    # Convert monotonic timestamp to seconds since epoch
+    return time() - (monotonic() - timestamp)
+
+
+def decibels(power):
+    return round(10 * log10(power), 1) if power > 0 else None
+
+
+def file_frames(recorders):
+    """
+    Video frames in a file, or audio sample frames if it only holds audio
+    """
+    video = [recorder.clip_stats() for recorder in recorders if isinstance(recorder, VideoRecorder)]
+    if video:
+        return sum(stats['frames'] + stats['duplicated'] for stats in video)
+    return sum(recorder.clip_stats()['frames'] for recorder in recorders)
+
+
+class EventRecorder:
+    """
+    Records each event into its own directory, split into segments of fixed duration.
+    Closed segments are listed in the event's index, so a crash only loses the open one
+    """
+
+    def close_segment(self, index, event_dir, base_path, files, start_time, stop_time):
+        entries = []
+        for path, recorders in files.items():
+            try:
+                file_size = os.path.getsize(path)
+            except OSError:
+                continue
+            # Next segment of the same stream gets the space this one ended up using
+            if Settings.PREALLOCATE:
+                self.reserve[path[len(base_path):]] = file_size
+            frames = file_frames(recorders)
+            entries.append({'name': os.path.basename(path), 'size': file_size, 'frames': frames})
+            for cam in self.cams:
+                if cam.proxy in recorders:
+                    self.proxy_files.setdefault(cam.cam_index, []).append((path, frames))
+
+        # Loudness of whole event accumulates over its segments
+        audio = self.mic.recorder.clip_stats()
+        samples = audio['frames'] * self.mic.channels
+        self.peak = max(self.peak, audio['peak'])
+        self.energy += audio['energy']
+        self.samples += samples
+        segment = {
+            'files': entries,
+            'start': wall_time(start_time),
+            'duration': round(stop_time - start_time, 3),
+            'size': sum(entry['size'] for entry in entries),
+            'video': {str(cam.cam_index): cam.recorder.clip_stats() for cam in self.cams},
+            'audio': {'peak_db': decibels(audio['peak'] ** 2),
+                      'mean_db': decibels(audio['energy'] / samples) if samples else None}
+        }
+        index['segments'].append(segment)
+        index['end'] = segment['start'] + segment['duration']
+        write_index(event_dir, index)
+        self.catalog.add_segment(event_dir, len(index['segments']), segment)
+
+    def run(self, event_dir, start_time):
+        """
+        Record segments until event is stopped, cutting them at exact monotonic times.
+        Pre-roll buffers carry data captured while previous segment is still being written
+        """
+        cams, mic = self.cams, self.mic
+        index = {
+            'start': wall_time(start_time),
+            'end': None,
+            'cameras': ','.join(str(cam.cam_index) for cam in cams),
+            'microphone': mic.name,
+            'trigger': self.trigger_source,
+            'segments': [],
+            'complete': False
+        }
+        write_index(event_dir, index)
+        self.catalog.begin(event_dir, index)
+        self.peak = self.energy = self.samples = 0
+        self.proxy_files = {}
+        number = 1
+        while True:
+            base_path = os.path.join(event_dir, 'part %03d' % number)
+            with self.lock:
+                if self.stopped.is_set() and self.stop_time <= start_time:
+                    break
+                files = start_event(cams, mic, base_path, start_time, self.reserve)
+                self.recording = True
+                if self.stopped.is_set():
+                    # Stopped while previous segment was being written
+                    stop_event(cams, mic, self.stop_time)
+            end_time = start_time + self.segment_duration if self.segment_duration else inf
+            self.stopped.wait(max(0, end_time - monotonic()) if self.segment_duration else None)
+            with self.lock:
+                self.recording = False
+                rotate = not self.stopped.is_set()
+                if rotate:
+                    stop_event(cams, mic, end_time)
+                else:
+                    end_time = min(end_time, self.stop_time)
+            wait_written(cams, mic)
+            self.close_segment(index, event_dir, base_path, files, start_time, end_time)
+            if not rotate:
+                break
+            start_time = end_time
+            number += 1
+        if self.proxy_files:
+            # Strip is made from small proxies, main clips aren't read again
+            index['thumbnails'] = write_thumbnails(event_dir, self.proxy_files)
+        index['complete'] = True
+        index['peak_db'] = decibels(self.peak ** 2)
+        index['mean_db'] = decibels(self.energy / self.samples) if self.samples else None
+        write_index(event_dir, index)
+        self.catalog.finish(event_dir, index)
+        self.retention.add(event_dir, index['start'])
+        self.retention.enforce()
+
+    def forget(self, event_dir):
+        # Retention deleted event from disk
+        if self.catalog:
+            self.catalog.remove(event_dir)
+
+    def start(self, cams, mic, output, trigger_time=None, trigger_source=None):
+        """
+        Start recording an event into output directory.
+        Recording starts pre-roll duration before the monotonic trigger time
+        """
+        if trigger_time is None:
+            trigger_time = monotonic()
+        with self.lock:
+            # Event is queued on its own thread, caller isn't blocked while previous one is written
+            self.queued = True
+            self.queued_stop = None
+            self.thread = Thread(target=self.begin, daemon=True,
+                                 args=[self.thread, cams, mic, output, trigger_time, trigger_source])
+            self.thread.start()
+
+    def begin(self, previous, cams, mic, output, trigger_time, trigger_source):
+        if previous:
+            # Let previous event finish writing, its pre-roll is still buffered
+            previous.join()
+        start_time = trigger_time - Settings.PREROLL_DURATION
+        date_time = datetime.fromtimestamp(wall_time(start_time))
+        event_dir = os.path.join(output, date_time.strftime('%d-%m-%Y %H-%M-%S'))
+        os.makedirs(event_dir, exist_ok=True)
+        if not self.catalog or self.catalog.output != output:
+            if self.catalog:
+                self.catalog.close()
+            self.catalog = Catalog(output)
+        self.retention.watch(output)
+        self.retention.begin(event_dir)
+
+        with self.lock:
+            # Stop requested while waiting for previous event applies to this one
+            self.queued = False
+            if self.queued_stop is None:
+                self.stopped.clear()
+                self.stop_time = inf
+            else:
+                self.stopped.set()
+                self.stop_time = self.queued_stop
+            self.cams = cams
+            self.mic = mic
+            self.trigger_source = trigger_source
+        self.run(event_dir, start_time)
+
+    def stop(self, stop_time=None):
+        """
+        Stop recording, data captured after monotonic stop time is discarded
+        """
+        with self.lock:
+            if self.queued:
+                self.queued_stop = monotonic() if stop_time is None else stop_time
+                return
+            self.stop_time = monotonic() if stop_time is None else stop_time
+            self.stopped.set()
+            if self.recording:
+                stop_event(self.cams, self.mic, self.stop_time)
+
+    def wait(self):
+        # Block until event being recorded is written
+        if self.thread:
+            self.thread.join()
+
+    def close(self):
+        if self.thread:
+            self.stop()
+            self.thread.join()
+        self.retention.close()
+        if self.catalog:
+            self.catalog.close()
+
+    def __init__(self, segment_duration=Settings.SEGMENT_DURATION):
+        self.segment_duration = segment_duration
+        self.retention = RetentionManager(on_delete=self.forget)
+        self.catalog = None
+        self.reserve = {}
+
+        self.cams = []
+        self.mic = None
+        self.trigger_source = None
+        self.thread = None
+        self.queued = False
+        self.queued_stop = None
+        self.lock = Lock()
+        self.stopped = Event()
+        self.stop_time = inf
+        self.recording = False
+
+        # Audio statistics of event being recorded
+        self.peak = 0
+        self.energy = 0
+        self.samples = 0
+        # Proxy files and their frame counts per camera, thumbnails are taken from them
+        self.proxy_files = {}
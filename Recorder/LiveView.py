@@ -0,0 +1,270 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, Condition
+from urllib.parse import urlsplit, parse_qs
+from time import monotonic, sleep
+import logging
+import json
+import re
+import numpy as np
+import cv2
+
+from Recorder.Metrics import registry
+import Config.Settings as Settings
+
+log = logging.getLogger(__name__)
+
+BOUNDARY = 'frame'
+
+PAGE = '''<!DOCTYPE html>
+<html><head><title>Live view</title></head>
+<body style="background: #000; color: #fff; font-family: sans-serif">
+<div id="level">- dB</div>
+%s
+<script>
+setInterval(function () {
+    fetch('level.json').then(function (response) { return response.json(); }).then(function (level) {
+        document.getElementById('level').textContent = (level.level_db === null ? '-' : level.level_db.toFixed(0))
+            + ' dB' + (level.recording ? '  REC' : '');
+    });
+}, 250);
+</script>
+</body></html>
+'''
+
+
+class LiveStream:
+    """
+    JPEG stream of one camera at one width. Every frame is encoded once and shared by all clients,
+    clients that can't keep up only ever get the latest frame
+    """
+
+    def camera(self):
+        # Cameras may be replaced while clients are watching, e.g. when resolution changes
+        for cam in self.owner.cams:
+            if cam.cam_index == self.cam_index:
+                return cam
+
+    def encode(self, cam):
+        """
+        Encode latest frame of camera, return False if there is none since the last one
+        """
+        if cam is not self.cam:
+            self.cam = cam
+            self.cam_seq = None
+        width, height = cam.pool.resolution
+        size = None
+        if self.width and self.width < width:
+            size = (self.width, round(height * self.width / width / 2) * 2)
+            width, height = size
+        if self.buffer is None or self.buffer.shape[:2] != (height, width):
+            self.buffer = np.empty((height, width, 3), dtype=np.uint8)
+        # Frame is copied out of its slot, capture keeps overwriting slots while it's encoded
+        latest = cam.retrieve_live(self.cam_seq, size, self.buffer)
+        if latest is None:
+            return False
+        self.cam_seq, frame = latest
+        ret, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, Settings.LIVE_JPEG_QUALITY])
+        if ret:
+            with self.condition:
+                self.frame = jpeg.tobytes()
+                self.count += 1
+                self.condition.notify_all()
+        return True
+
+    def run(self):
+        interval = 1 / Settings.LIVE_MAX_FPS
+        while True:
+            with self.condition:
+                if not self.clients or self.closed:
+                    self.running = False
+                    return
+            cam = self.camera()
+            start = monotonic()
+            if cam is None or not self.encode(cam):
+                sleep(Settings.PREVIEW_POLL_INTERVAL / 1000)
+                continue
+            # Frame rate is capped, encoding cost doesn't depend on number of clients
+            sleep(max(0, interval - (monotonic() - start)))
+
+    def attach(self):
+        with self.condition:
+            self.clients += 1
+            if not self.running:
+                self.running = True
+                Thread(target=self.run, daemon=True).start()
+
+    def detach(self):
+        with self.condition:
+            self.clients -= 1
+
+    def wait(self, count, timeout=1):
+        """
+        Wait for a frame newer than count, return latest frame and its count
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.count != count or self.closed, timeout)
+            return self.frame, self.count
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __init__(self, owner, cam_index, width=None):
+        self.owner = owner
+        self.cam_index = cam_index
+        self.width = width
+
+        self.cam = None
+        self.cam_seq = None
+        self.buffer = None
+
+        # Latest encoded frame, count increases with every frame
+        self.frame = None
+        self.count = 0
+        self.clients = 0
+        self.running = False
+        self.closed = False
+        self.condition = Condition()
+
+
+class LiveViewHandler(BaseHTTPRequestHandler):
+    # Clients that stop reading are dropped after this many seconds
+    timeout = Settings.LIVE_CLIENT_TIMEOUT
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, stream):
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=' + BOUNDARY)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            count = 0
+            while not stream.closed:
+                frame, latest = stream.wait(count)
+                if latest == count:
+                    continue
+                count = latest
+                header = '--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % (BOUNDARY, len(frame))
+                self.wfile.write(header.encode() + frame + b'\r\n')
+        except OSError:
+            # Client went away or stopped reading
+            pass
+        finally:
+            self.server.live.release(stream)
+
+    def do_GET(self):
+        live = self.server.live
+        url = urlsplit(self.path)
+        match = re.fullmatch(r'/cam(\d+)\.mjpg', url.path)
+        if match:
+            width = parse_qs(url.query).get('width')
+            try:
+                stream = live.stream(int(match.group(1)), int(width[0]) if width else None)
+            except (KeyError, ValueError):
+                self.send_error(404)
+                return
+            self.send_stream(stream)
+        elif url.path == '/level.json':
+            self.send_body(json.dumps(live.level()).encode(), 'application/json')
+        elif url.path == '/':
+            images = ''.join('<img src="cam%d.mjpg" alt="Cam %d">\n' % (cam.cam_index, cam.cam_index)
+                             for cam in live.owner.cams)
+            self.send_body((PAGE % images).encode(), 'text/html; charset=utf-8')
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_live_view(owner, port=Settings.LIVE_PORT):
+    """
+    Start live view of owner's cameras if enabled, recording carries on without it if port is taken
+    """
+    if not port:
+        return None
+    try:
+        return LiveViewServer(owner, port)
+    except OSError as error:
+        log.warning('Live view unavailable on port %d: %s', port, error)
+        return None
+
+
+class LiveViewServer:
+    """
+    Serves cameras of owner as multipart MJPEG at /camN.mjpg and audio level at /level.json.
+    Owner is anything with cams and mic attributes, cameras only decode extra frames while watched
+    """
+
+    def stream(self, cam_index, width=None):
+        """
+        Attach a client to shared stream of camera at width, raise KeyError for unknown cameras.
+        Width snaps to one of a few sizes, so clients asking for any width still share streams
+        """
+        cam = next((cam for cam in self.owner.cams if cam.cam_index == cam_index), None)
+        if cam is None:
+            raise KeyError(cam_index)
+        if width is not None:
+            width = next((size for size in Settings.LIVE_WIDTHS if size >= width), None)
+            if width and width >= cam.pool.resolution[0]:
+                # No smaller than camera, shares full size stream
+                width = None
+        with self.lock:
+            key = (cam_index, width)
+            if key not in self.streams:
+                self.streams[key] = LiveStream(self.owner, cam_index, width)
+            stream = self.streams[key]
+            stream.attach()
+            return stream
+
+    def release(self, stream):
+        # Streams are dropped with their last client, their thread stops by itself
+        with self.lock:
+            stream.detach()
+            if not stream.clients and self.streams.get((stream.cam_index, stream.width)) is stream:
+                del self.streams[(stream.cam_index, stream.width)]
+
+    def level(self):
+        mic = self.owner.mic
+        volume = mic.volume if mic else None
+        return {
+            'level_db': round(float(volume), 1) if volume is not None and np.isfinite(volume) else None,
+            'recording': any(cam.rec_status == 2 for cam in self.owner.cams),
+            'cameras': [cam.cam_index for cam in self.owner.cams]
+        }
+
+    def metrics(self):
+        with self.lock:
+            streams = list(self.streams.values())
+        for stream in streams:
+            labels = {'camera': stream.cam_index, 'width': stream.width or 'full'}
+            yield 'camrec_live_clients', labels, stream.clients
+            yield 'camrec_live_frames_encoded_total', labels, stream.count
+
+    def close(self):
+        registry.unregister(self)
+        with self.lock:
+            for stream in self.streams.values():
+                stream.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __init__(self, owner, port=Settings.LIVE_PORT, host=Settings.LIVE_HOST):
+        self.owner = owner
+        self.streams = {}
+        self.lock = Lock()
+        self.server = ThreadingHTTPServer((host, port), LiveViewHandler)
+        self.server.daemon_threads = True
+        self.server.live = self
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        registry.register(self)
+        log.info('Serving live view on http://%s:%d/', host, self.server.server_port)
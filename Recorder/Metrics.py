@@ -0,0 +1,239 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from contextlib import contextmanager
+from bisect import bisect_left
+from math import isnan, inf
+from time import perf_counter
+import importlib
+import logging
+
+import Config.Settings as Settings
+
+log = logging.getLogger(__name__)
+
+# Type and help text of every metric, samples are rendered in this order
+METRICS = {
+    'camrec_frames_captured_total': ('counter', 'Frames captured by camera'),
+    'camrec_frames_decoded_total': ('counter', 'Captured frames decoded for preview, trigger or writer'),
+    'camrec_capture_fps': ('gauge', 'Measured capture frame rate'),
+    'camrec_capture_mode': ('gauge', 'Frame rate granted by driver, labelled with pixel format and resolution'),
+    'camrec_frames_encoded_total': ('counter', 'Frames handed to video encoder'),
+    'camrec_frames_dropped_total': ('counter', 'Frames lost before encoding, by reason'),
+    'camrec_frames_duplicated_total': ('counter', 'Frames repeated to keep constant frame rate files in time'),
+    'camrec_encode_seconds': ('histogram', 'Time to encode and write a single frame'),
+    'camrec_audio_blocks_written_total': ('counter', 'Audio blocks written to file or container'),
+    'camrec_audio_blocks_dropped_total': ('counter', 'Audio blocks lost because writer fell behind'),
+    'camrec_audio_callback_seconds': ('histogram', 'Time spent in audio stream callback'),
+    'camrec_audio_xruns_total': ('counter', 'Input overflows reported by audio stream'),
+    'camrec_audio_level_db': ('gauge', 'Current audio level'),
+    'camrec_queue_depth': ('gauge', 'Items waiting for writer'),
+    'camrec_queue_max_depth': ('gauge', 'Most items ever waiting for writer'),
+    'camrec_triggers_total': ('counter', 'Recordings started by trigger'),
+    'camrec_trigger_active': ('gauge', 'Whether trigger is currently recording'),
+    'camrec_live_clients': ('gauge', 'Clients watching live view stream'),
+    'camrec_live_frames_encoded_total': ('counter', 'Frames JPEG encoded for live view stream'),
+    'camrec_startup_seconds': ('gauge', 'Duration of startup step, or time since start for milestones'),
+}
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, observing a value is a bisect and three additions
+    """
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """
+        Yield cumulative bucket, sum and count samples in exposition format
+        """
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield name + '_bucket', dict(labels, le=str(bound)), cumulative
+        yield name + '_sum', labels, self.sum
+        yield name + '_count', labels, self.count
+
+    def merge(self, other):
+        # Add observations made elsewhere, e.g. by an encoder process
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def __init__(self, buckets=Settings.METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+class MetricsRegistry:
+    """
+    Components register themselves and report (name, labels, value) samples through a metrics method.
+    Nothing is computed until metrics are scraped
+    """
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ''
+        pairs = ('%s="%s"' % (key, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                 for key, value in labels.items())
+        return '{%s}' % ','.join(pairs)
+
+    @staticmethod
+    def format_value(value):
+        value = float(value)
+        if isnan(value):
+            return 'NaN'
+        if value in (inf, -inf):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+
+    def register(self, component):
+        with self.lock:
+            self.components.append(component)
+
+    def unregister(self, component):
+        with self.lock:
+            if component in self.components:
+                self.components.remove(component)
+
+    def render(self):
+        """
+        Return all samples in Prometheus text format
+        """
+        with self.lock:
+            components = list(self.components)
+        samples = {name: [] for name in METRICS}
+        for component in components:
+            for name, labels, value in component.metrics():
+                samples[name].append((labels, value))
+        lines = []
+        for name, (metric_type, description) in METRICS.items():
+            if not samples[name]:
+                continue
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            for labels, value in samples[name]:
+                if isinstance(value, Histogram):
+                    for sample_name, sample_labels, sample_value in value.samples(name, labels):
+                        lines.append('%s%s %s' % (sample_name, self.format_labels(sample_labels),
+                                                  self.format_value(sample_value)))
+                else:
+                    lines.append('%s%s %s' % (name, self.format_labels(labels), self.format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def __init__(self):
+        self.components = []
+        self.lock = Lock()
+
+
+# Shared by all devices and recorders of the process
+registry = MetricsRegistry()
+
+
+class StartupTimer:
+    """
+    Durations of startup steps and milestones, timed from the first import of this module
+    """
+
+    @contextmanager
+    def measure(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def mark(self, name):
+        # Milestone only carries time since start
+        self.record(name, None)
+
+    def record(self, name, duration):
+        with self.lock:
+            self.steps.append((name, duration, perf_counter() - self.start))
+
+    def import_modules(self, names):
+        """
+        Import libraries one by one so each is timed on its own, missing optional ones are skipped
+        """
+        for name in names:
+            with self.measure('import ' + name):
+                try:
+                    importlib.import_module(name)
+                except (ImportError, OSError):
+                    pass
+
+    def report(self):
+        lines = ['%-28s %9s %9s' % ('Startup step', 'took', 'done at')]
+        with self.lock:
+            for name, duration, end in self.steps:
+                took = '' if duration is None else '%.0f ms' % (duration * 1000)
+                lines.append('%-28s %9s %6.0f ms' % (name, took, end * 1000))
+        return '\n'.join(lines)
+
+    def metrics(self):
+        with self.lock:
+            steps = list(self.steps)
+        for name, duration, end in steps:
+            yield 'camrec_startup_seconds', {'step': name}, end if duration is None else duration
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.steps = []
+        self.lock = Lock()
+        registry.register(self)
+
+
+startup = StartupTimer()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the log
+        pass
+
+
+def start_server(port=Settings.METRICS_PORT):
+    """
+    Start metrics endpoint if enabled, recording carries on without it if port is taken
+    """
+    if not port:
+        return None
+    try:
+        return MetricsServer(port)
+    except OSError as error:
+        log.warning('Metrics endpoint unavailable on port %d: %s', port, error)
+        return None
+
+
+class MetricsServer:
+    """
+    Serves registry at /metrics on a local HTTP port
+    """
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __init__(self, port=Settings.METRICS_PORT, host=Settings.METRICS_HOST):
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        log.info('Serving metrics on http://%s:%d/metrics', host, self.server.server_port)
@@ -0,0 +1,125 @@
+from threading import Lock
+from fractions import Fraction
+
+try:
+    import av
+except ImportError:
+    av = None
+
+from Recorder.Storage import preallocate, release
+from Recorder.Encoders import add_stream
+import Config.Settings as Settings
+
+
+class Muxer:
+    """
+    Single container holding audio and video of one event.
+    Presentation timestamps are relative to a shared monotonic clock
+    """
+
+    @staticmethod
+    def available():
+        return av is not None
+
+    def add_video_stream(self, resolution, fps, preset='xvid'):
+        """
+        Add video stream for a camera, return its index
+        """
+        stream = add_stream(self.container, preset, fps, resolution)
+        # Millisecond time base so frames can be placed by capture time
+        stream.codec_context.time_base = self.video_time_base
+        self.video_streams.append(stream)
+        self.video_pts.append(-1)
+        self.streams += 1
+        return len(self.video_streams) - 1
+
+    def add_audio_stream(self, samplerate, channels):
+        stream = self.container.add_stream(Settings.MUX_AUDIO_CODEC, rate=samplerate)
+        # Default layout of channel count, e.g. mono, stereo or 5.1
+        stream.layout = av.AudioLayout('%dc' % channels)
+        self.audio_stream = stream
+        self.channels = channels
+        self.streams += 1
+
+    def mux(self, packets):
+        if not packets:
+            return
+        with self.lock:
+            self.container.mux(packets)
+            if self.reserve:
+                # PyAV only creates the file once the header is written along with the first packet
+                preallocate(self.out_path, self.reserve)
+                self.reserve = 0
+
+    def write_video(self, frame, timestamp, stream=0):
+        """
+        Encode BGR frame captured at monotonic timestamp into video stream
+        """
+        pts = round((timestamp - self.start_time) / self.video_time_base)
+        # Frames before start and non-increasing timestamps can't be placed
+        if pts < 0 or pts <= self.video_pts[stream]:
+            return
+        self.video_pts[stream] = pts
+        video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+        video_frame.pts = pts
+        video_frame.time_base = self.video_time_base
+        self.mux(self.video_streams[stream].encode(video_frame))
+
+    def write_audio(self, in_data, timestamp):
+        """
+        Encode float32 audio block whose first sample was captured at monotonic timestamp
+        """
+        samplerate = self.audio_stream.rate
+        if self.audio_pts is None:
+            # Audio clock is sample accurate, only the first block gets placed by timestamp
+            pts = round((timestamp - self.start_time) * samplerate)
+            if pts + len(in_data) <= 0:
+                return
+            if pts < 0:
+                in_data = in_data[-pts:]
+                pts = 0
+            self.audio_pts = pts
+        audio_frame = av.AudioFrame.from_ndarray(in_data.reshape(1, -1), format='flt',
+                                                 layout=self.audio_stream.layout.name)
+        audio_frame.sample_rate = samplerate
+        audio_frame.pts = self.audio_pts
+        audio_frame.time_base = Fraction(1, samplerate)
+        self.audio_pts += len(in_data)
+        self.mux(self.audio_stream.encode(audio_frame))
+
+    def finish_video(self, stream=0):
+        try:
+            self.mux(self.video_streams[stream].encode(None))
+        finally:
+            self.finish_stream()
+
+    def finish_audio(self):
+        try:
+            self.mux(self.audio_stream.encode(None))
+        finally:
+            self.finish_stream()
+
+    def finish_stream(self):
+        # Container is closed once all streams are done
+        with self.lock:
+            self.streams -= 1
+            if self.streams == 0:
+                try:
+                    self.container.close()
+                finally:
+                    release(self.out_path)
+
+    def __init__(self, out_path, start_time, reserve=0):
+        self.out_path = out_path
+        self.start_time = start_time
+        self.reserve = reserve
+        self.container = av.open(out_path, mode='w')
+        self.lock = Lock()
+
+        self.streams = 0
+        self.video_streams = []
+        self.audio_stream = None
+        self.video_time_base = Fraction(1, 1000)
+        self.video_pts = []
+        self.audio_pts = None
+        self.channels = 0
@@ -0,0 +1,153 @@
+from collections import deque
+from threading import Thread, Condition, Lock
+from math import ceil
+import numpy as np
+import cv2
+
+import Config.Settings as Settings
+
+
+class CompressedBuffer:
+    """
+    Circular pre-roll buffer holding JPEG compressed frames within a memory budget
+    """
+
+    def encode_frames(self):
+        """
+        Compress pending frames off the capture thread
+        """
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                index, seq = self.encoding = self.pending.popleft()
+            frame = self.pool.get(index, seq)
+            if frame is not None:
+                timestamp = self.pool.timestamps[index]
+                ok, data = cv2.imencode('.jpg', frame, self.encode_params)
+                # Capture may have overwritten slot while it was compressed
+                ok = ok and self.pool.valid(index, seq)
+            with self.condition:
+                self.encoding = None
+                # Skip frames whose slot got overwritten before compression
+                if frame is not None and ok:
+                    self.frames.append((seq, timestamp, data))
+                    self.size += data.nbytes
+                    # Drop oldest frames exceeding pre-roll duration or memory budget
+                    while len(self.frames) > self.maxlen or self.size > self.memory_budget:
+                        self.size -= self.frames.popleft()[2].nbytes
+
+    def contents(self, after_seq=-1):
+        """
+        Return compressed frames as (seq, timestamp, data) and frame slots pending compression as (index, seq),
+        only those newer than given sequence number
+        """
+        with self.condition:
+            frames = [frame for frame in self.frames if frame[0] > after_seq]
+            pending = [slot for slot in self.pending if slot[1] > after_seq]
+            if self.encoding and self.encoding[1] > after_seq:
+                pending.insert(0, self.encoding)
+        return frames, pending
+
+    def snapshot(self, after_seq=-1):
+        """
+        Yield sequence numbers, timestamps and decoded copy of buffered frames newer than given sequence number,
+        oldest first
+        """
+        frames, pending = self.contents(after_seq)
+        for seq, timestamp, data in frames:
+            yield seq, timestamp, cv2.imdecode(data, cv2.IMREAD_COLOR)
+        # Frames which haven't been compressed yet
+        for index, seq in pending:
+            frame = self.pool.copy(index, seq)
+            if frame is not None:
+                yield seq, self.pool.timestamps[index], frame
+
+    def append(self, index, seq):
+        with self.condition:
+            self.pending.append((index, seq))
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.encoder_thread.join()
+
+    def __len__(self):
+        return len(self.frames) + len(self.pending)
+
+    def __init__(self, pool, maxlen, memory_budget, quality=90):
+        self.pool = pool
+        self.maxlen = maxlen
+        self.memory_budget = memory_budget
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+        # Size of all compressed frames in bytes
+        self.size = 0
+        self.frames = deque()
+        self.encoding = None
+        # Frame slots waiting for compression, oldest are dropped if encoder falls behind
+        self.pending = deque(maxlen=max(8, maxlen // 10))
+
+        self.running = True
+        self.condition = Condition()
+        self.encoder_thread = Thread(target=self.encode_frames, daemon=True)
+        self.encoder_thread.start()
+
+
+class AudioRing:
+    """
+    Preallocated contiguous ring holding the most recent audio samples for pre-roll.
+    Holds headroom on top of the pre-roll, so flushed views stay valid while being written
+    """
+
+    def write(self, in_data, timestamp):
+        """
+        Copy audio block whose first sample was captured at monotonic timestamp into ring
+        """
+        frames = len(in_data)
+        capacity = self.capacity
+        if frames > capacity:
+            timestamp += (frames - capacity) / self.samplerate
+            in_data = in_data[-capacity:]
+            frames = capacity
+        with self.lock:
+            position = self.position
+            first = min(frames, capacity - position)
+            self.buffer[position:position + first] = in_data[:first]
+            if first < frames:
+                self.buffer[:frames - first] = in_data[first:]
+            self.position = (position + frames) % capacity
+            self.filled = min(capacity, self.filled + frames)
+            self.end_time = timestamp + frames / self.samplerate
+
+    def views(self, start_time):
+        """
+        Return pre-roll since monotonic start time as at most two (timestamp, view) pairs, oldest first
+        """
+        with self.lock:
+            position, filled, end_time = self.position, self.filled, self.end_time
+        samples = min(filled, self.preroll)
+        if start_time > end_time - samples / self.samplerate:
+            samples = max(0, round((end_time - start_time) * self.samplerate))
+        start = (position - samples) % self.capacity
+        timestamp = end_time - samples / self.samplerate
+        if start + samples <= self.capacity:
+            return [(timestamp, self.buffer[start:start + samples])]
+        first = self.capacity - start
+        return [(timestamp, self.buffer[start:]),
+                (timestamp + first / self.samplerate, self.buffer[:samples - first])]
+
+    def __init__(self, samplerate, channels, duration, headroom=Settings.AUDIO_RING_HEADROOM):
+        self.samplerate = samplerate
+        self.preroll = ceil(samplerate * duration)
+        self.capacity = self.preroll + ceil(samplerate * headroom)
+        self.buffer = np.zeros((self.capacity, channels), dtype=np.float32)
+
+        self.position = 0
+        self.filled = 0
+        self.end_time = 0
+        self.lock = Lock()
@@ -0,0 +1,160 @@
+from collections import deque
+from threading import Thread, Event, Lock
+from time import time
+import ctypes.util
+import logging
+import shutil
+import ctypes
+import json
+import os
+
+import Config.Settings as Settings
+
+log = logging.getLogger(__name__)
+
+# Only Linux can reserve blocks past the end of a file, elsewhere preallocation is skipped
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fallocate = libc.fallocate
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+except (OSError, AttributeError, TypeError):
+    fallocate = None
+FALLOC_FL_KEEP_SIZE = 1
+
+
+def preallocate(path, size):
+    """
+    Reserve disk blocks for a file that is being written without changing its size.
+    Writer keeps appending into contiguous space instead of growing the file block by block
+    """
+    if not fallocate or not size:
+        return
+    try:
+        fd = os.open(path, os.O_WRONLY)
+    except OSError:
+        return
+    try:
+        fallocate(fd, FALLOC_FL_KEEP_SIZE, 0, size)
+    finally:
+        os.close(fd)
+
+
+def release(path):
+    # Truncating to its own size frees blocks reserved past the end of file
+    try:
+        os.truncate(path, os.path.getsize(path))
+    except OSError:
+        pass
+
+
+def read_index(event_dir):
+    try:
+        with open(os.path.join(event_dir, Settings.SEGMENT_INDEX_FILE)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_index(event_dir, index):
+    """
+    Replace index of an event atomically, it never lists a segment that is still open
+    """
+    path = os.path.join(event_dir, Settings.SEGMENT_INDEX_FILE)
+    with open(path + '.tmp', 'w') as file:
+        json.dump(index, file, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+class RetentionManager:
+    """
+    Deletes oldest events from output directory once they exceed maximum age or free space
+    drops below minimum. Output directory is indexed once, finished events are added as they
+    close, so each check only queries disk usage
+    """
+
+    def scan(self):
+        # Only directories carrying a segment index were written by us
+        events = []
+        try:
+            with os.scandir(self.output) as entries:
+                for entry in entries:
+                    if entry.is_dir() and entry.path not in self.active:
+                        index = read_index(entry.path)
+                        if index:
+                            events.append((index['start'], entry.path))
+        except OSError:
+            pass
+        events.sort()
+        self.events = deque(events)
+
+    def watch(self, output):
+        """
+        Manage given output directory, it's only scanned when it changes
+        """
+        with self.lock:
+            if output != self.output:
+                self.output = output
+                self.scan()
+
+    def begin(self, event_dir):
+        # Event being recorded is never deleted
+        with self.lock:
+            self.active.add(event_dir)
+
+    def add(self, event_dir, start):
+        with self.lock:
+            self.active.discard(event_dir)
+            if os.path.dirname(event_dir) == self.output:
+                self.events.append((start, event_dir))
+
+    def free_space(self):
+        try:
+            return shutil.disk_usage(self.output).free
+        except OSError:
+            return None
+
+    def enforce(self):
+        """
+        Delete oldest events until all remaining ones are young enough and enough space is free.
+        Newest event is always kept, as are events still being recorded
+        """
+        with self.lock:
+            cutoff = time() - self.max_age
+            while self.events:
+                start, event_dir = self.events[0]
+                expired = self.max_age and start < cutoff
+                free = self.free_space() if self.min_free else None
+                if not expired and (free is None or free >= self.min_free):
+                    break
+                if len(self.events) == 1:
+                    if not expired:
+                        log.warning('Only %d bytes free on %s, newest event is kept', free, self.output)
+                    break
+                self.events.popleft()
+                shutil.rmtree(event_dir, ignore_errors=True)
+                log.info('Deleted event %s', event_dir)
+                if self.on_delete:
+                    self.on_delete(event_dir)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.enforce()
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def __init__(self, max_age=Settings.RETENTION_MAX_AGE, min_free=Settings.RETENTION_MIN_FREE,
+                 interval=Settings.RETENTION_INTERVAL, on_delete=None):
+        self.max_age = max_age
+        self.on_delete = on_delete
+        self.min_free = min_free
+        self.interval = interval
+
+        self.output = None
+        self.events = deque()
+        self.active = set()
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
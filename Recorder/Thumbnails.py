@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import cv2
+
+import Config.Settings as Settings
+
+
+def sample_frames(files, count):
+    """
+    Yield up to count frames evenly spread over consecutive video files given as (path, frame count) pairs.
+    Files are read front to back, frames in between are only grabbed, not decoded into images
+    """
+    total = sum(frames for path, frames in files)
+    count = min(count, total)
+    if not count:
+        return
+    targets = [int((i + 0.5) * total / count) for i in range(count)]
+    position = 0
+    for path, frames in files:
+        cap = cv2.VideoCapture(path)
+        try:
+            for number in range(position, position + frames):
+                if not targets:
+                    return
+                if not cap.grab():
+                    break
+                if number == targets[0]:
+                    targets.pop(0)
+                    ret, frame = cap.retrieve()
+                    if ret:
+                        yield frame
+        finally:
+            cap.release()
+        position += frames
+
+
+def write_thumbnails(event_dir, proxy_files, count=Settings.THUMBNAIL_COUNT, width=Settings.THUMBNAIL_WIDTH):
+    """
+    Write strip of thumbnails into event directory, one row per camera from its proxy files.
+    Return file name, None if no frame could be read
+    """
+    rows = []
+    for cam_index in sorted(proxy_files):
+        tiles = []
+        for frame in sample_frames(proxy_files[cam_index], count):
+            height = round(frame.shape[0] * width / frame.shape[1])
+            tiles.append(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+        if tiles:
+            rows.append(np.hstack(tiles))
+    if not rows:
+        return None
+    # Rows of cameras with fewer frames or other aspect ratios are padded with black
+    strip = np.zeros((sum(row.shape[0] for row in rows), max(row.shape[1] for row in rows), 3), dtype=np.uint8)
+    y = 0
+    for row in rows:
+        strip[y:y + row.shape[0], :row.shape[1]] = row
+        y += row.shape[0]
+    cv2.imwrite(os.path.join(event_dir, Settings.THUMBNAIL_FILE), strip,
+                [cv2.IMWRITE_JPEG_QUALITY, Settings.THUMBNAIL_QUALITY])
+    return Settings.THUMBNAIL_FILE
@@ -0,0 +1,162 @@
+from threading import Thread, Lock
+from time import monotonic
+from queue import SimpleQueue
+from math import inf
+import numpy as np
+
+from Recorder.Metrics import registry
+import Config.Settings as Settings
+
+
+class TriggerEngine:
+    """
+    Trigger evaluated on every block inside the audio stream callback and, depending on mode,
+    on motion detected by cameras.
+    Recording starts once the level reaches the threshold (attack) and stops once it
+    stayed below threshold minus hysteresis (release) for hold time. Level is either
+    the per sample peak, broadband RMS or the energy of a configured frequency band.
+    Start and stop events carry sample accurate monotonic timestamps and are handed
+    to on_start / on_stop on a separate thread, so the audio callback never blocks.
+    Cameras queue motion without locking, it is evaluated with the next audio block.
+    Source of the latest start is kept in start_source
+    """
+
+    def audio_level(self, analyzer, timestamp, block_end):
+        """
+        Return time of attack and last time level stayed above release threshold within block
+        """
+        samplerate = analyzer.samplerate
+        if self.source == 'peak':
+            # Per sample peak across channels, placing attack and release to the sample
+            level = analyzer.sample_peak
+            attack = np.flatnonzero(level >= 10 ** (self.threshold / 20))
+            release = np.flatnonzero(level >= 10 ** ((self.threshold - self.hysteresis) / 20))
+            attack_time = timestamp + attack[0] / samplerate if attack.size else None
+            loud_time = timestamp + release[-1] / samplerate if release.size else None
+            return attack_time, loud_time
+        # Broadband RMS or band level only resolve to the block
+        if self.source == 'rms':
+            level = analyzer.volume
+        else:
+            level = analyzer.band_level(self.source)
+        attack_time = timestamp if level >= self.threshold else None
+        loud_time = block_end if level >= self.threshold - self.hysteresis else None
+        return attack_time, loud_time
+
+    def level(self, analyzer):
+        """
+        Level in dB of analysed block as compared against threshold, shown by level meters
+        """
+        if self.source == 'peak':
+            return analyzer.to_db(float(analyzer.sample_peak.max()) ** 2)
+        if self.source == 'rms':
+            return analyzer.volume
+        return analyzer.band_level(self.source)
+
+    def process(self, analyzer, timestamp):
+        """
+        Feed analysed audio block whose first sample was captured at monotonic timestamp
+        """
+        # Motion queued by cameras since the previous block
+        while not self.motions.empty():
+            motion_time = self.motions.get()
+            self.last_motion = max(self.last_motion, motion_time)
+            if self.armed and self.mode in ('motion', 'or'):
+                self.evaluate(motion_time, motion_time, motion_time, 'motion')
+        if not self.armed:
+            return
+        block_end = timestamp + analyzer.frames / analyzer.samplerate
+        attack_time = loud_time = None
+        if self.mode != 'motion':
+            attack_time, loud_time = self.audio_level(analyzer, timestamp, block_end)
+        if self.mode == 'and' and block_end - self.last_motion > Settings.MOTION_WINDOW:
+            # Audio only counts together with recent motion
+            attack_time = loud_time = None
+        # Audio blocks also serve as clock for releasing motion triggers
+        origin = 'audio+motion' if self.mode == 'and' else 'audio:' + self.source
+        self.evaluate(attack_time, loud_time, block_end, origin)
+
+    def motion(self, timestamp):
+        """
+        Feed motion detected by a camera in frame captured at monotonic timestamp, never blocks
+        """
+        self.motions.put(timestamp)
+
+    def evaluate(self, attack_time, loud_time, now, origin=None):
+        """
+        Advance trigger state, called from audio callback. Lock is only shared with disarm
+        """
+        with self.lock:
+            if not self.active:
+                if attack_time is None:
+                    return
+                self.active = True
+                self.last_loud = attack_time
+                self.start_source = origin
+                self.emit('start', attack_time)
+            if loud_time is not None:
+                self.last_loud = max(self.last_loud, loud_time)
+            if now - self.last_loud > self.hold_time:
+                self.active = False
+                self.emit('stop', self.last_loud + self.hold_time)
+
+    def emit(self, event, timestamp):
+        if event == 'start':
+            self.trigger_count += 1
+        self.events.put((event, timestamp))
+
+    def dispatch(self):
+        """
+        Hand events over to handlers outside of the audio callback
+        """
+        while True:
+            event, timestamp = self.events.get()
+            if event is None:
+                return
+            handler = self.on_start if event == 'start' else self.on_stop
+            if handler:
+                handler(timestamp)
+
+    def metrics(self):
+        yield 'camrec_triggers_total', {}, self.trigger_count
+        yield 'camrec_trigger_active', {}, self.active
+
+    def arm(self):
+        self.armed = True
+
+    def disarm(self):
+        self.armed = False
+        with self.lock:
+            if self.active:
+                self.active = False
+                self.emit('stop', monotonic())
+
+    def close(self):
+        registry.unregister(self)
+        self.events.put((None, None))
+        self.dispatch_thread.join()
+
+    def __init__(self, threshold, on_start=None, on_stop=None, hold_time=Settings.TRIGGER_HOLD_TIME,
+                 hysteresis=Settings.TRIGGER_HYSTERESIS, source=Settings.TRIGGER_SOURCE,
+                 mode=Settings.TRIGGER_MODE):
+        self.threshold = threshold
+        self.source = source
+        self.mode = mode
+        self.hold_time = hold_time
+        self.hysteresis = hysteresis
+        self.on_start = on_start
+        self.on_stop = on_stop
+
+        self.armed = False
+        self.active = False
+        self.start_source = None
+        self.last_loud = 0
+        self.last_motion = -inf
+        self.lock = Lock()
+        self.trigger_count = 0
+
+        self.events = SimpleQueue()
+        self.motions = SimpleQueue()
+        self.dispatch_thread = Thread(target=self.dispatch, daemon=True)
+        self.dispatch_thread.start()
+        registry.register(self)
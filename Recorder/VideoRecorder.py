@@ -1,43 +1,297 @@
 from collections import deque
-from time import sleep
-import cv2
-
-
-class VideoRecorder:
-    def flush_buffer(self, out_file):
-        # Flush circular buffer
-        for frame in list(self.circ_buffer):
-            out_file.write(frame)
-
-    def save_file(self, out_path):
-        self.is_recording = True
-        query_interval = 1 / self.fps
-        out_file = cv2.VideoWriter(out_path, self.writer, self.fps, self.resolution)
-        self.flush_buffer(out_file)
-        while self.record:
-            if len(self.frame_buffer) > 0:
-                frame = self.frame_buffer.popleft()
-                out_file.write(frame)
-            sleep(query_interval)
-        out_file.release()
-        self.is_recording = False
-
-    def add_frame(self, frame):
-        # Add frame to write to a file
-        self.frame_buffer.append(frame)
-
-    def buffer_frame(self, frame):
-        # Add frame to circular buffer
-        self.circ_buffer.append(frame)
-
-    def __init__(self, resolution, fps, buffer_duration=5, frame_buffer_size=300):
-        self.resolution = resolution
+from time import perf_counter
+from math import inf, isfinite
+import numpy as np
+
+from Recorder.Storage import release
+from Recorder.Metrics import Histogram
+from Recorder.Encoders import open_writer
+from Recorder.PrerollBuffer import CompressedBuffer
+from Recorder.WriterQueue import WriterQueue
+from Recorder.WriterPool import ClipWriter
+import Config.Settings as Settings
+
+
+class VideoRecorder(ClipWriter):
+    def buffered_frames(self, after_seq=-1):
+        """
+        Yield sequence numbers, timestamps and copies of frames from circular buffer newer than given
+        sequence number, skipping slots overwritten in the meantime
+        """
+        for index, seq in list(self.circ_buffer):
+            if seq <= after_seq:
+                continue
+            frame = self.pool.copy(index, seq, self.frame_copy)
+            if frame is not None:
+                yield seq, self.pool.timestamps[index], frame
+
+    def last_pass(self, taken):
+        """
+        Circular buffer keeps filling while pre-roll is written, frames captured meanwhile are taken from it
+        instead of the frame pool, where they'd be overwritten before a slow encoder gets to them.
+        Once a pass is as short as a writer batch, the next one is the last and frames get queued again
+        """
+        if taken <= Settings.WRITER_BATCH or not self.record:
+            # Frames in both last pass and queue are skipped by sequence number
+            self.flushing = False
+        return not self.flushing
+
+    def flush_buffer(self, write):
+        """
+        Write circular buffer, return sequence number of last frame taken from it
+        """
+        last_seq = -1
+        taken = inf
+        while True:
+            last = self.last_pass(taken)
+            if self.compress_buffer:
+                # Compressed frames get decoded one at a time while writing
+                frames = self.circ_buffer.snapshot(last_seq)
+            else:
+                frames = self.buffered_frames(last_seq)
+            taken = 0
+            for seq, timestamp, frame in frames:
+                last_seq = seq
+                taken += 1
+                # Skip pre-roll older than requested start, or captured after trigger released
+                if self.start_time <= timestamp <= self.stop_time:
+                    started = perf_counter()
+                    if write(frame, timestamp):
+                        self.written()
+                    self.encode_time.observe(perf_counter() - started)
+            if last:
+                return last_seq
+
+    def flush_remote(self):
+        """
+        Hand circular buffer over to encoder process, return sequence number of last frame taken from it
+        """
+        last_seq = -1
+        taken = inf
+        while True:
+            last = self.last_pass(taken)
+            if self.compress_buffer:
+                frames, slots = self.circ_buffer.contents(last_seq)
+            else:
+                frames, slots = [], [(index, seq) for index, seq in list(self.circ_buffer) if seq > last_seq]
+            for seq, timestamp, data in frames:
+                if self.start_time <= timestamp <= self.stop_time:
+                    self.send_paced(data, timestamp)
+                last_seq = seq
+            for index, seq in slots:
+                timestamp = self.pool.timestamps[index]
+                if self.start_time <= timestamp <= self.stop_time:
+                    self.send_paced((index, seq), timestamp)
+                last_seq = seq
+            if last:
+                return last_seq
+            taken = len(frames) + len(slots)
+
+    def send_paced(self, frame, timestamp):
+        """
+        Hand compressed pre-roll frame or slot the encoder process reads from shared memory over to it.
+        Encoder process fills the gap before the frame by repeating the last frame it wrote, which
+        stays valid when its slot got overwritten in the meantime
+        """
+        count = self.frame_slots(timestamp)
+        if count:
+            if isinstance(frame, tuple):
+                self.encoder.write(self.job_id, *frame, count - 1)
+            else:
+                self.encoder.write_compressed(self.job_id, frame, count - 1)
+        # Frames are counted once the encoder process reports which ones it actually wrote
+        self.written(0)
+
+    def frame_slots(self, timestamp):
+        """
+        Number of times frame captured at monotonic timestamp goes into a constant frame rate file.
+        Frame clock starts at start of clip, like the audio file, or at first frame without a start time.
+        A gap is filled with frames and a frame is dropped if its slot is already taken, so file duration
+        follows capture time whatever rate the camera delivers
+        """
+        if not Settings.CONSTANT_FRAME_RATE:
+            return 1
+        if self.clock_start is None:
+            self.clock_start = self.start_time if isfinite(self.start_time) else timestamp
+        slot = round((timestamp - self.clock_start) * self.fps)
+        count = slot + 1 - self.clock_slots
+        if count <= 0:
+            self.paced_drops += 1
+            return 0
+        self.duplicated_frames += count - 1
+        self.clock_slots = slot + 1
+        return count
+
+    def write_paced(self, frame, timestamp):
+        """
+        Write frame into constant frame rate file, return False if it was dropped.
+        Gap before it repeats the previous frame, or this one at the start of the clip
+        """
+        count = self.frame_slots(timestamp)
+        if not count:
+            return False
+        previous = frame if self.previous_frame is None else self.previous_frame
+        for _ in range(count - 1):
+            self.out_file.write(previous)
+        self.out_file.write(frame)
+        # Frame copy is reused for the next frame
+        np.copyto(self.last_frame, frame)
+        self.previous_frame = self.last_frame
+        return True
+
+    def write_frame(self, frame, timestamp):
+        if self.muxer:
+            # Frames are placed in container by their capture timestamp, no pacing needed
+            self.muxer.write_video(frame, timestamp, self.stream)
+            return True
+        return self.write_paced(frame, timestamp)
+
+    def open_clip(self):
+        # Circular buffer goes first, queued frames that were part of it are skipped later
+        if self.muxer:
+            self.last_seq = self.flush_buffer(self.write_frame)
+        elif self.encoder:
+            self.job_id = self.encoder.open(self.pool, self.out_path, self.preset, self.fps, self.reserve)
+            self.last_seq = self.flush_remote()
+        else:
+            self.out_file = open_writer(self.out_path, self.preset, self.fps, self.pool.resolution,
+                                        reserve=self.reserve)
+            if not self.out_file.isOpened():
+                raise OSError('Could not open %s' % self.out_path)
+            self.last_seq = self.flush_buffer(self.write_frame)
+
+    def write_items(self, items):
+        for index, seq in items:
+            timestamp = self.pool.timestamps[index]
+            if seq <= self.last_seq or timestamp > self.stop_time:
+                # Already written as part of circular buffer, or captured after trigger released
+                continue
+            if self.job_id is not None:
+                # Only slot indices are passed on, encoder process reads frames from shared memory
+                self.send_paced((index, seq), timestamp)
+                continue
+            # Copied first, capture may overwrite slot while frame is encoded
+            frame = self.pool.copy(index, seq, self.frame_copy)
+            if frame is None:
+                # Slot got overwritten before frame could be written
+                self.stale_frames += 1
+                continue
+            started = perf_counter()
+            if self.write_frame(frame, timestamp):
+                self.written()
+            self.encode_time.observe(perf_counter() - started)
+
+    def finish_clip(self):
+        try:
+            if self.muxer:
+                # Container is only closed once every stream finished, even a failed one
+                self.muxer.finish_video(self.stream)
+            elif self.job_id is not None:
+                written, stale, duplicated, encode_time = self.encoder.close(self.job_id)
+                self.written_frames += written
+                self.stale_frames += stale
+                self.duplicated_frames += duplicated
+                self.encode_time.merge(encode_time)
+            elif self.out_file is not None:
+                self.out_file.release()
+                release(self.out_path)
+        finally:
+            self.flushing = False
+            self.job_id = None
+            self.out_file = None
+
+    def written(self, frames=1):
+        super().written()
+        self.written_frames += frames
+
+    def metrics(self, labels):
+        # Encoder processes report frames and encode times of a clip once it is closed
+        yield 'camrec_frames_encoded_total', labels, self.written_frames
+        yield 'camrec_frames_dropped_total', dict(labels, reason='queue'), self.frame_queue.dropped
+        yield 'camrec_frames_dropped_total', dict(labels, reason='stale'), self.stale_frames
+        yield 'camrec_frames_dropped_total', dict(labels, reason='pacing'), self.paced_drops
+        yield 'camrec_frames_duplicated_total', labels, self.duplicated_frames
+        yield 'camrec_encode_seconds', labels, self.encode_time
+        yield 'camrec_queue_depth', dict(labels, queue='video'), len(self.frame_queue)
+        yield 'camrec_queue_max_depth', dict(labels, queue='video'), self.frame_queue.max_depth
+
+    def add_frame(self, index, seq):
+        # Add frame slot to write to a file, unless it is taken from circular buffer along with pre-roll
+        if not self.flushing:
+            self.frame_queue.put((index, seq))
+
+    def start(self, start_time=None):
+        self.clock_start = None
+        self.clock_slots = 0
+        self.previous_frame = None
+        self.clip_start = (self.written_frames, self.duplicated_frames, self.dropped_frames, self.paced_drops)
+        # Until pre-roll is flushed frames are only buffered
+        self.flushing = True
+        super().start(start_time)
+
+    @property
+    def dropped_frames(self):
+        return self.frame_queue.dropped + self.stale_frames
+
+    def clip_stats(self):
+        """
+        Frames written, duplicated and dropped since recording was last started
+        """
+        written, duplicated, dropped, paced = self.clip_start
+        return {
+            'frames': self.written_frames - written,
+            'duplicated': self.duplicated_frames - duplicated,
+            'dropped': self.dropped_frames - dropped,
+            'paced_drops': self.paced_drops - paced
+        }
+
+    def buffer_frame(self, index, seq):
+        # Add frame slot to circular buffer
+        if self.compress_buffer:
+            self.circ_buffer.append(index, seq)
+        else:
+            self.circ_buffer.append((index, seq))
+
+    def close(self):
+        if self.compress_buffer:
+            self.circ_buffer.close()
+
+    def __init__(self, pool, fps, buffer_duration=5, frame_buffer_size=300,
+                 compress_buffer=Settings.PREROLL_COMPRESSED, encoder=None, preset='xvid'):
+        self.pool = pool
+        # Frames are encoded from this copy of their slot
+        self.frame_copy = np.empty_like(pool.frames[0])
+        self.encoder = encoder
+        self.preset = preset
         self.fps = fps
+        self.compress_buffer = compress_buffer
 
-        self.record = False
-        self.is_recording = False
+        self.flushing = False
 
         buffer_size = int(fps * buffer_duration)
-        self.circ_buffer = deque(maxlen=buffer_size)
-        self.frame_buffer = deque(maxlen=frame_buffer_size)
-        self.writer = cv2.VideoWriter_fourcc(*'XVID')
+        if compress_buffer:
+            self.circ_buffer = CompressedBuffer(pool, buffer_size, Settings.PREROLL_MEMORY_BUDGET,
+                                                Settings.PREROLL_JPEG_QUALITY)
+        else:
+            self.circ_buffer = deque(maxlen=buffer_size)
+        self.frame_queue = WriterQueue(frame_buffer_size)
+        self.stale_frames = 0
+        self.written_frames = 0
+        self.encode_time = Histogram()
+
+        # Constant frame rate clock of clip being written
+        self.clock_start = None
+        self.clock_slots = 0
+        # Frame repeated to fill gaps in a local file, encoder processes keep their own
+        self.previous_frame = None
+        self.last_frame = np.empty_like(pool.frames[0])
+        self.duplicated_frames = 0
+        self.paced_drops = 0
+        self.clip_start = (0, 0, 0, 0)
+        self.reserve = 0
+
+        # File of clip being written, frames up to last sequence number were part of its pre-roll
+        self.out_file = None
+        self.job_id = None
+        self.last_seq = -1
+        super().__init__(self.frame_queue)
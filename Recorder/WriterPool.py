@@ -0,0 +1,151 @@
+from abc import ABC, abstractmethod
+from threading import Thread, Lock
+from functools import partial
+from time import monotonic
+from math import inf
+from queue import SimpleQueue
+import logging
+
+import Config.Settings as Settings
+
+log = logging.getLogger(__name__)
+
+
+class WriterPool:
+    """
+    Fixed set of threads writing the files of all cameras and the microphone.
+    A writer is queued whenever data arrives for it, a thread writes one batch and queues it again
+    while more is waiting, so any number of clips share the same threads
+    """
+
+    def submit(self, writer):
+        # Never blocks, capture threads and the audio callback hand writers over directly
+        if len(self.threads) < self.size:
+            self.start()
+        self.ready.put(writer)
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.size:
+                thread = Thread(target=self.run, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def run(self):
+        while True:
+            writer = self.ready.get()
+            if writer.write_pending():
+                self.ready.put(writer)
+
+    def __init__(self, size=Settings.WRITER_THREADS):
+        self.size = size
+        self.ready = SimpleQueue()
+        self.threads = []
+        self.lock = Lock()
+
+
+# Shared by all recorders, threads start with the first clip
+writers = WriterPool()
+
+
+class ClipWriter(ABC):
+    """
+    Recorder whose clips are written by the writer pool. Subclasses open the clip and write its pre-roll,
+    write batches of queued items and finish the clip, is_recording clears once it is finished
+    """
+
+    def start(self, start_time=None):
+        """
+        Start accepting items, pre-roll is cut at monotonic start time
+        """
+        self.start_time = -inf if start_time is None else start_time
+        self.stop_time = inf
+        self.first_write = None
+        self.record = True
+        # Set right away so event can wait for writer before it even started
+        self.is_recording = True
+        self.writer_queue.open()
+
+    def stop(self, stop_time=None):
+        """
+        Stop recording, items captured after monotonic stop time are discarded
+        """
+        if stop_time is not None:
+            self.stop_time = stop_time
+        self.record = False
+        self.writer_queue.close()
+
+    def written(self):
+        # Statistics, time of first write after start tells how long a trigger takes to reach the file
+        if self.first_write is None:
+            self.first_write = monotonic()
+
+    @abstractmethod
+    def open_clip(self):
+        pass
+
+    @abstractmethod
+    def write_items(self, items):
+        pass
+
+    @abstractmethod
+    def finish_clip(self):
+        pass
+
+    def save_file(self, out_path, muxer=None, stream=0):
+        """
+        Write clip started with start() to out path, or to stream of muxer
+        """
+        self.out_path = out_path
+        self.muxer = muxer
+        self.stream = stream
+        self.clip_open = False
+        self.clip_error = None
+        writers.submit(self)
+
+    def attempt(self, step, *args):
+        # After an error the rest of the clip is discarded, file is still finished
+        if self.clip_error is None:
+            try:
+                step(*args)
+            except Exception as error:
+                log.exception('Writing %s failed', self.out_path)
+                self.clip_error = error
+
+    def write_pending(self):
+        """
+        Write a batch of queued items, called by writer pool. Return True while more may be waiting
+        """
+        if not self.clip_open:
+            self.clip_open = True
+            self.attempt(self.open_clip)
+        # Only taken once clip is open, a writer found idle may be picked up by another thread right away
+        items = self.writer_queue.take(Settings.WRITER_BATCH)
+        if items:
+            self.attempt(self.write_items, items)
+            return True
+        if items is not None:
+            return False
+        try:
+            self.finish_clip()
+        except Exception:
+            log.exception('Finishing %s failed', self.out_path)
+        finally:
+            # Event waits for is_recording, a failed clip must not hold up the next one
+            self.is_recording = False
+        return False
+
+    def __init__(self, writer_queue):
+        # Data arriving in queue gets the writer scheduled
+        self.writer_queue = writer_queue
+        writer_queue.on_ready = partial(writers.submit, self)
+        self.record = False
+        self.is_recording = False
+        self.start_time = -inf
+        self.stop_time = inf
+        self.first_write = None
+        self.out_path = None
+        self.muxer = None
+        self.stream = 0
+        self.clip_open = False
+        self.clip_error = None
@@ -0,0 +1,74 @@
+from collections import deque
+from threading import Lock
+
+
+class WriterQueue:
+    """
+    Bounded queue between a capture source and the writer pool.
+    Producers never block, items not fitting into the queue are dropped and counted.
+    While open, on_ready is called whenever items or the end of the clip wait for a writer that isn't scheduled
+    """
+
+    def put(self, item):
+        """
+        Queue item for writer, return False if it had to be dropped
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            if len(self.items) >= self.capacity:
+                self.dropped += 1
+                return False
+            self.items.append(item)
+            self.max_depth = max(self.max_depth, len(self.items))
+            ready = not self.scheduled
+            self.scheduled = True
+        if ready:
+            self.on_ready()
+        return True
+
+    def take(self, limit):
+        """
+        Return up to limit items without blocking, None once queue is closed and drained.
+        Writer is unscheduled when nothing is waiting, the next item schedules it again
+        """
+        with self.lock:
+            if self.items:
+                return [self.items.popleft() for _ in range(min(limit, len(self.items)))]
+            if self.closed:
+                return None
+            self.scheduled = False
+            return []
+
+    def open(self):
+        # Writer is scheduled by whoever starts the clip
+        with self.lock:
+            self.items.clear()
+            self.closed = False
+            self.scheduled = True
+
+    def close(self):
+        # Remaining items are still handed out, writer finishes clip once they are written
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            ready = not self.scheduled
+            self.scheduled = True
+        if ready:
+            self.on_ready()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __init__(self, capacity, on_ready=None):
+        self.capacity = capacity
+        self.on_ready = on_ready
+        self.items = deque()
+        self.lock = Lock()
+        self.closed = True
+        self.scheduled = False
+
+        # Statistics
+        self.dropped = 0
+        self.max_depth = 0
@@ -0,0 +1,43 @@
+from argparse import ArgumentParser
+import json
+import sys
+
+from Benchmark.Suite import run_suite, compare, format_table
+import Config.Settings as Settings
+
+
+def parse_args():
+    parser = ArgumentParser(description='Benchmark capture and recording on synthetic or file sources, '
+                                        'no camera or sound card required')
+    parser.add_argument('--resolution', choices=Settings.RESOLUTIONS, nargs='+', default=Settings.RESOLUTIONS)
+    parser.add_argument('--duration', type=float, default=20, help='seconds per resolution')
+    parser.add_argument('--cameras', type=int, default=1, help='number of simulated cameras')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--fast', action='store_true', help='run sources as fast as possible instead of real time, '
+                        'measures throughput but not latency')
+    parser.add_argument('--video', help='video file played instead of synthetic frames')
+    parser.add_argument('--audio', help='sound file played instead of synthetic noise and bursts')
+    parser.add_argument('--threshold', type=int, default=-20, help='trigger threshold in dB')
+    parser.add_argument('--preset', choices=Settings.ENCODER_PRESETS, default='xvid', help='video encoder preset')
+    parser.add_argument('--proxy', action='store_true', help='also write low resolution proxy of every clip')
+    parser.add_argument('--encoders', type=int, default=Settings.ENCODER_PROCESSES, help='encoder processes')
+    parser.add_argument('--json', help='write results to file')
+    parser.add_argument('--baseline', help='results of an earlier run, exit with 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change counted as regression')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    suite = run_suite(args)
+    print(format_table(suite))
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(suite, file, indent=1)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(suite, json.load(file), args.tolerance)
+        for regression in regressions:
+            print('Regression:', regression)
+        if regressions:
+            sys.exit(1)
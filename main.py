@@ -1,5 +1,77 @@
-from GUI.MainWindow import MainWindow
+from argparse import ArgumentParser
+from datetime import datetime
+import logging
+import os
+
+# Startup is timed from here, heavy libraries are only imported once needed
+from Recorder.Metrics import startup
+import Config.Settings as Settings
+
+
+def parse_args():
+    parser = ArgumentParser(description='Record video and audio once audio level exceeds a threshold')
+    parser.add_argument('--headless', action='store_true', help='run without GUI, e.g. as a service')
+    parser.add_argument('--config', help='config file used in headless mode, defaults to GUI config')
+    parser.add_argument('--camera', type=int, nargs='+', help='video device indices, all cameras record together')
+    parser.add_argument('--resolution', choices=Settings.RESOLUTIONS)
+    parser.add_argument('--mic', type=int, help='audio input device index')
+    parser.add_argument('--threshold', type=int, help='trigger threshold in dB')
+    parser.add_argument('--output', help='output directory')
+    parser.add_argument('--no-overlay', dest='overlay', action='store_false', default=None,
+                        help='disable HUD in video')
+    parser.add_argument('--proxy', action='store_true', default=None,
+                        help='also write low resolution proxies and a thumbnail strip per event')
+    parser.add_argument('--metrics-port', type=int, help='Prometheus metrics port on localhost, 0 disables it')
+    parser.add_argument('--live-port', type=int, help='MJPEG live view port on localhost, 0 disables it')
+    parser.add_argument('--startup-times', action='store_true', help='log how long imports and device setup took')
+    parser.add_argument('--rebuild-catalog', action='store_true', help='rebuild event catalog of output directory')
+    parser.add_argument('--list-events', action='store_true', help='list recorded events and exit')
+    parser.add_argument('--since', type=datetime.fromisoformat, help='only list events after this time')
+    parser.add_argument('--until', type=datetime.fromisoformat, help='only list events before this time')
+    parser.add_argument('--min-db', type=float, help='only list events at least this loud')
+    return parser.parse_args()
+
+
+def catalog_command(args):
+    """
+    Rebuild or query event catalog of output directory without starting any device
+    """
+    from Headless.Daemon import Daemon
+    from Recorder.Catalog import Catalog
+    from Config import ConfigUtils
+
+    output = args.output or Daemon.load_config(args.config)['output'] or str(ConfigUtils.get_documents_dir())
+    with Catalog(output) as catalog:
+        if args.rebuild_catalog:
+            print('Catalogued %d events in %s' % (catalog.rebuild(), output))
+        if args.list_events:
+            events = catalog.find(args.since and args.since.timestamp(), args.until and args.until.timestamp(),
+                                  args.min_db)
+            for event in events:
+                start = datetime.fromtimestamp(event['start'])
+                duration = event['end'] - event['start'] if event['end'] else 0
+                peak = '%.1f dB' % event['peak_db'] if event['peak_db'] is not None else '-'
+                print('%s  %7.1f s  %9s  %6.1f MB  %s' % (start.strftime('%Y-%m-%d %H:%M:%S'), duration, peak,
+                                                          event['size'] / 2 ** 20,
+                                                          os.path.join(output, event['directory'])))
+
 
 if __name__ == '__main__':
-    with MainWindow() as main:
-        main.window.mainloop()
+    args = parse_args()
+    if args.rebuild_catalog or args.list_events:
+        catalog_command(args)
+    elif args.headless:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        with startup.measure('import recorder'):
+            from Headless.Daemon import Daemon
+
+        with Daemon(args) as daemon:
+            daemon.run()
+    else:
+        if args.startup_times:
+            logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        with startup.measure('import GUI'):
+            from GUI.MainWindow import MainWindow
+
+        with MainWindow() as main:
+            main.window.mainloop()